@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+from ingredient_trie import RankedCompleter
+
+
+class Autocomplete:
+    """
+    The object suggests ingredient names as the user types. Library ingredients are ranked by how often they are
+    used across every user's recipes, and a user's own ingredients are boosted by how often they cook with them. The
+    usage ranking is rebuilt when the library changes or AUTOCOMPLETE_COUNTS_TTL seconds have passed, so new recipes
+    reach it on every worker. Each user's boosts record the user's data_version and are kept for the
+    AUTOCOMPLETE_USERS most recent users, so boosts left behind by a write through another worker are reloaded
+    """
+
+    def __init__(self, app=None, trie=None, limit=10):
+        self.app = app
+        self.trie = trie
+        self.limit = limit
+        self.version = None
+        self.loaded_at = None
+        self.ttl = 300
+        self.completer = RankedCompleter({}, limit)
+        self.size = 256
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get("AUTOCOMPLETE_COUNTS_TTL", self.ttl)
+        self.size = app.config.get("AUTOCOMPLETE_USERS", self.size)
+
+    def library_loaded(self, version):
+        """ Whether the usage ranking reflects the given library version and is younger than the TTL """
+        return self.loaded_at is not None and self.version == version and time.monotonic() - self.loaded_at < self.ttl
+
+    def load_library(self, version, counts):
+        """ Ranks every word in the Trie by its recipe usage, each library entry counting once on its own """
+        weights = {word: 1 + counts.get(word, 0) for word in self.trie.words()}
+        self.completer = RankedCompleter(weights, self.limit)
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    def loaded(self, user_id, version):
+        """ Whether the user's boosts reflect the given data_version """
+        with self.lock:
+            entry = self.users.get(user_id)
+            if entry is not None:
+                self.users.move_to_end(user_id)
+            return entry is not None and entry[0] == version
+
+    def load_user(self, user_id, version, counts):
+        with self.lock:
+            self.users[user_id] = version, counts
+            self.users.move_to_end(user_id)
+            while len(self.users) > self.size:
+                self.users.popitem(last=False)
+
+    def suggest(self, prefix, user_id, limit=None):
+        """ Merges the top library completions with the user's own matching ingredients and returns the best names """
+        limit = min(limit or self.limit, self.limit)
+        prefix = prefix.lstrip().title()
+        completer = self.completer
+        with self.lock:
+            _, counts = self.users.get(user_id, (None, {}))
+        scores = dict(completer.complete(prefix))
+        for word, count in counts.items():
+            if word.startswith(prefix):
+                scores[word] = scores.get(word, completer.weight(word)) + count
+        return sorted(scores, key=lambda word: (-scores[word], word))[:limit]
@@ -0,0 +1,139 @@
+"""
+Measures login throughput under concurrent load against a threaded server, hashing inline in the request thread and
+in the credentials process pool, along with the latency of a cheap page requested while the logins run.
+
+    python -m benchmarks.login --concurrency 1 4 16 --output login.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks.run import summarize, expect, commit
+
+
+def login_burst(url, users, concurrency, logins):
+    """ Runs `logins` logins from `concurrency` clients while a probe keeps requesting the home page """
+    done = threading.Event()
+    probes = []
+
+    def probe():
+        with requests.Session() as session:
+            while not done.is_set():
+                start = time.perf_counter()
+                expect(session.get(f"{url}/"), 200)
+                probes.append(time.perf_counter() - start)
+
+    def client(n):
+        samples = []
+        with requests.Session() as session:
+            for i in range(n, logins, concurrency):
+                email = users[i % len(users)]
+                start = time.perf_counter()
+                expect(session.post(f"{url}/login", data={"email": email, "password": "benchmark"},
+                                    allow_redirects=False), 302)
+                samples.append(time.perf_counter() - start)
+        return samples
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = [sample for result in pool.map(client, range(concurrency)) for sample in result]
+    elapsed = time.perf_counter() - start
+    done.set()
+    prober.join()
+    return {
+        "logins_per_second": round(logins / elapsed, 2),
+        "login": summarize(samples),
+        "page_during_logins": summarize(probes),
+    }
+
+
+def run(method, workers, concurrency, logins, users):
+    workdir = tempfile.mkdtemp(prefix="meal_planner_login_")
+    os.environ.update({
+        "SECRET_KEY": "benchmark",
+        "SPOON_API": "benchmark",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'meals.db')}",
+        "RECIPE_CACHE_URL": f"sqlite:///{os.path.join(workdir, 'recipe_cache.db')}",
+        "TRIE_SNAPSHOT": os.path.join(workdir, "ingredient_trie.bin"),
+        "UPLOAD_FOLDER": workdir,
+        "PASSWORD_HASH_METHOD": method,
+    })
+    import main
+
+    app = main.create_app({"WTF_CSRF_ENABLED": False})
+    credentials = app.extensions["meal_planner"]["credentials"]
+    with app.app_context():
+        main.init_db()
+    client = app.test_client()
+    emails = [f"user{i}@example.com" for i in range(users)]
+    for email in emails:
+        expect(client.post("/register", data={"name": "bench", "email": email, "password": "benchmark"}), 302)
+        client.get("/logout")
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    results = {}
+    try:
+        for mode, pool_workers in [("inline", 0), ("pool", workers)]:
+            app.config["PASSWORD_HASH_WORKERS"] = pool_workers
+            credentials.init_app(app)
+            for level in concurrency:
+                results[f"{mode}_c{level}"] = login_burst(url, emails, level, logins)
+    finally:
+        server.shutdown()
+        thread.join()
+        credentials.shutdown()
+
+    return {
+        "meta": {
+            "commit": commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "method": method,
+            "pool_workers": workers,
+            "logins": logins,
+            "users": users,
+        },
+        "results": results,
+    }
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--method", default="pbkdf2:sha256:260000", help="password hash policy")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="hashing pool processes")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--logins", type=int, default=64, help="logins per concurrency level")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = run(args.method, args.workers, args.concurrency, args.logins, args.users)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,320 @@
+"""
+Runs the benchmark suite against a throwaway SQLite database and a stub Spoonacular server, then writes the timings
+as JSON so runs from different commits can be compared.
+
+    python -m benchmarks.run --scale 10 --output bench.json
+    python -m benchmarks.run --scale 10 --compare bench.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timezone
+
+from benchmarks.stub_spoonacular import StubSpoonacular
+from benchmarks.synthetic import Dataset, csv_bytes
+
+
+def summarize(samples, per=1):
+    """ Milliseconds per operation over the samples, each of which timed `per` operations """
+    samples = sorted(sample / per * 1000 for sample in samples)
+    return {
+        "n": len(samples),
+        "min_ms": round(samples[0], 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+    }
+
+
+def expect(response, status):
+    """ Fails the run rather than timing a request that did not do its work """
+    if response.status_code != status:
+        raise RuntimeError(f"{response.request.method} {response.request.path} returned {response.status_code}, "
+                           f"expected {status}")
+    return response
+
+
+def levenshtein(a, b):
+    row = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        previous, row[0] = row[0], i
+        for j, cb in enumerate(b, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (ca != cb))
+    return row[-1]
+
+
+def typo(rng, word):
+    """ The word with one random character deleted, replaced or inserted """
+    i = rng.randrange(len(word))
+    edit = rng.choice(["delete", "replace", "insert"])
+    if edit == "delete":
+        return word[:i] + word[i + 1:]
+    c = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    return word[:i] + c + word[i + (edit == "replace"):]
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scale, seed, repeat, latency):
+    workdir = tempfile.mkdtemp(prefix="meal_planner_bench_")
+    uploads = os.path.join(workdir, "files")
+    os.makedirs(uploads)
+    data = Dataset(scale, seed)
+    results = {}
+
+    with StubSpoonacular(latency) as stub:
+        os.environ.update({
+            "SECRET_KEY": "benchmark",
+            "SPOON_API": "benchmark",
+            "SPOONACULAR_URL": stub.url,
+            "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'meals.db')}",
+            "RECIPE_CACHE_URL": f"sqlite:///{os.path.join(workdir, 'recipe_cache.db')}",
+            "TRIE_SNAPSHOT": os.path.join(workdir, "ingredient_trie.bin"),
+            "UPLOAD_FOLDER": uploads,
+            # Hashing is measured by benchmarks.login, here it would only slow down registering the users
+            "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+        })
+        import main
+        from ingredient_trie import CompactTrie
+        from page_cache import MemoryBackend
+        from sqlalchemy import event
+
+        app = main.create_app({"WTF_CSRF_ENABLED": False})
+        extensions = app.extensions["meal_planner"]
+        statements = []
+        with app.app_context():
+            main.init_db()
+            event.listen(main.db.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+        # Trie
+        trie = CompactTrie(app)
+        results["trie_build"] = summarize(measure(lambda: trie.rebuild(data.library), repeat))
+        snapshot = os.path.join(workdir, "bench_trie.bin")
+        trie.save(snapshot, "bench")
+        results["trie_snapshot_load"] = summarize(measure(lambda: trie.load(snapshot), repeat))
+        probes = [data.rng.choice(data.library) for _ in range(1000)] + [f"Missing {i}" for i in range(1000)]
+        results["trie_search_per_1000"] = summarize(
+            measure(lambda: [trie.search(word) for word in probes], repeat), per=len(probes) / 1000
+        )
+        prefixes = [word[:3] for word in probes[:1000]]
+        results["trie_prefix_per_1000"] = summarize(measure(lambda: [trie.get_prefix(p) for p in prefixes], repeat))
+
+        # Fuzzy lookup against a brute-force scan computing the distance to every normalized library name
+        from ingredient_trie import IngredientIndex
+        index = IngredientIndex(data.library)
+        keys = list(index.names)
+        typos = [typo(data.rng, data.rng.choice(keys)) for _ in range(200)]
+
+        def brute_force(query, max_distance):
+            return sorted((key, d) for key in keys if (d := levenshtein(query, key)) <= max_distance)
+        for max_distance in (1, 2):
+            expected = [sorted(brute_force(query, max_distance)) for query in typos]
+            if [sorted(index.keys.fuzzy(query, max_distance)) for query in typos] != expected:
+                raise RuntimeError(f"fuzzy lookup disagrees with the brute-force scan at distance {max_distance}")
+            results[f"fuzzy_lookup_d{max_distance}"] = summarize(
+                measure(lambda: [index.keys.fuzzy(query, max_distance) for query in typos], repeat), per=len(typos)
+            )
+            results[f"fuzzy_brute_force_d{max_distance}"] = summarize(
+                measure(lambda: [brute_force(query, max_distance) for query in typos], max(1, repeat // 10)),
+                per=len(typos)
+            )
+
+        library_csv = csv_bytes(data.library)
+        with app.app_context():
+            start = time.perf_counter()
+            extensions["csv_handler"].import_library(io.BytesIO(library_csv), f"library_{date.today()}.csv")
+            results["library_import"] = summarize([time.perf_counter() - start])
+            start = time.perf_counter()
+            extensions["csv_handler"].load_library()
+            results["library_load_cold"] = summarize([time.perf_counter() - start])
+
+        htmls = [recipe["ingredients"] for recipe in data.recipes]
+        extract = extensions["trie"].extract
+        extract(htmls[0])
+        results["ingredient_extraction"] = summarize(measure(lambda: [extract(html) for html in htmls], repeat),
+                                                     per=len(htmls))
+
+        # Routes
+        client = app.test_client()
+        expect(client.post("/register", data={"name": "bench", "email": "bench@example.com",
+                                              "password": "benchmark"}), 302)
+        for category in data.categories:
+            expect(client.post("/create_category/1", data={"name": category, "icon_img": ""}), 302)
+
+        saves = []
+        for recipe in data.recipes:
+            category_id = data.categories.index(recipe["category"]) + 1
+            start = time.perf_counter()
+            expect(client.post(f"/create_recipe/1/{category_id}", data={
+                "name": recipe["name"], "recipe_type": recipe["category"], "img": "", "link": "https://example.com",
+                "ingredients": recipe["ingredients"], "directions": recipe["directions"],
+            }), 302)
+            saves.append(time.perf_counter() - start)
+        results["recipe_save"] = summarize(saves)
+
+        def edit_name():
+            recipe = data.recipes[0]
+            expect(client.post("/edit_recipe/1?recipe_id=1", data={
+                "name": f"Renamed {time.perf_counter()}", "recipe_type": recipe["category"], "img": "",
+                "link": "https://example.com", "ingredients": recipe["ingredients"], "directions": recipe["directions"],
+            }), 302)
+        results["recipe_edit_name_only"] = summarize(measure(edit_name, repeat))
+
+        pantry = csv_bytes(data.pantry)
+
+        def upload():
+            expect(client.post("/add_ingredient/1", data={"file": (io.BytesIO(pantry), "pantry.csv")},
+                               content_type="multipart/form-data"), 302)
+        results["pantry_import_cold"] = summarize(measure(upload, 1))
+        results["pantry_import_existing"] = summarize(measure(upload, repeat))
+
+        for page in ["my_recipes", "my_week", "my_ingredients"]:
+            url = f"/{page}/1"
+
+            def cold():
+                extensions["page_cache"].backend = MemoryBackend()
+                expect(client.get(url), 200)
+            cold()
+            statements.clear()
+            cold()
+            count = len(statements)
+            results[f"page_{page}_cold"] = {**summarize(measure(cold, repeat)), "statements": count}
+            results[f"page_{page}_cached"] = summarize(measure(lambda: expect(client.get(url), 200), repeat))
+            etag = client.get(url).headers["ETag"]
+            results[f"page_{page}_304"] = summarize(
+                measure(lambda: expect(client.get(url, headers={"If-None-Match": etag}), 304), repeat)
+            )
+
+        # The other synthetic users fill the shared ingredient dictionary and the per-user caches and indexes
+        users = []
+        for user in data.users[1:]:
+            user_client = app.test_client()
+            expect(user_client.post("/register", data={"name": "user", "email": user["email"],
+                                                       "password": "benchmark"}), 302)
+            with app.app_context():
+                user_id = main.db.session.scalar(main.db.select(main.User.id).where(main.User.email == user["email"]))
+            for category in user["categories"]:
+                expect(user_client.post(f"/create_category/{user_id}", data={"name": category, "icon_img": ""}),
+                       302)
+            with app.app_context():
+                category_ids = list(main.db.session.scalars(
+                    main.db.select(main.Category.id).where(main.Category.user_id == user_id).order_by(main.Category.id)
+                ))
+            users.append((user, user_id, user_client, category_ids))
+
+        saves, imports = [], []
+        for user, user_id, user_client, category_ids in users:
+            for recipe in user["recipes"]:
+                category_id = category_ids[user["categories"].index(recipe["category"])]
+                start = time.perf_counter()
+                expect(user_client.post(f"/create_recipe/{user_id}/{category_id}", data={
+                    "name": recipe["name"], "recipe_type": recipe["category"], "img": "",
+                    "link": "https://example.com", "ingredients": recipe["ingredients"],
+                    "directions": recipe["directions"],
+                }), 302)
+                saves.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            expect(user_client.post(f"/add_ingredient/{user_id}", data={
+                "file": (io.BytesIO(csv_bytes(user["pantry"])), "pantry.csv")
+            }, content_type="multipart/form-data"), 302)
+            imports.append(time.perf_counter() - start)
+        results["users_recipe_save"] = summarize(saves)
+        results["users_pantry_import"] = summarize(imports)
+
+        for name, url in [("my_recipes", "/my_recipes/{}"), ("cook_now", "/cook_now/{}?format=json")]:
+            for label in ("first", "again"):
+                samples = []
+                for _, user_id, user_client, _ in users:
+                    start = time.perf_counter()
+                    expect(user_client.get(url.format(user_id)), 200)
+                    samples.append(time.perf_counter() - start)
+                results[f"users_{name}_{label}"] = summarize(samples)
+
+        queries = iter(range(repeat * 2))
+        calls = stub.calls
+        results["search_cold"] = summarize(
+            measure(lambda: expect(client.post("/search/1", data={"recipe": f"query {next(queries)}"}), 200), repeat)
+        )
+        results["search_cold"]["upstream_calls"] = stub.calls - calls
+        results["search_cached"] = summarize(
+            measure(lambda: expect(client.post("/search/1", data={"recipe": "query 0"}), 200), repeat)
+        )
+
+    return {
+        "meta": {
+            "commit": commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": scale,
+            "seed": seed,
+            "repeat": repeat,
+            "stub_latency": latency,
+        },
+        "data": {
+            "library": len(data.library),
+            "users": len(data.users),
+            "recipes": len(data.recipes),
+            "pantry": len(data.pantry),
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline):
+    """ Prints each benchmark's median against the baseline report, slowest regressions first """
+    rows = []
+    for name, result in report["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before and before["median_ms"]:
+            rows.append((result["median_ms"] / before["median_ms"], name, before["median_ms"], result["median_ms"]))
+    for ratio, name, before, after in sorted(rows, reverse=True):
+        print(f"{name:32} {before:12.4f} ms {after:12.4f} ms {ratio:7.2f}x")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1, choices=[1, 10, 100])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02, help="stub Spoonacular delay in seconds")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON report to compare the medians against")
+    args = parser.parse_args()
+
+    report = run(args.scale, args.seed, args.repeat, args.latency)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as file:
+            compare(report, json.load(file))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,59 @@
+"""
+A stand-in for the Spoonacular API serving canned search and information responses after a fixed delay, so the
+search routes can be measured without the network or an API key
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        time.sleep(self.server.latency)
+        self.server.calls += 1
+        if url.path == "/recipes/complexSearch":
+            query = parse_qs(url.query).get("query", [""])[0]
+            body = {"results": [{"id": 1000 + i, "title": f"{query} {i}", "image": ""} for i in range(12)],
+                    "totalResults": 12}
+        elif url.path.startswith("/recipes/") and url.path.endswith("/information"):
+            recipe_id = int(url.path.split("/")[2])
+            body = {"id": recipe_id, "title": f"Recipe {recipe_id}", "readyInMinutes": 30, "servings": 4,
+                    "extendedIngredients": [], "instructions": ""}
+        else:
+            self.send_error(404)
+            return
+
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubSpoonacular:
+    """ Runs the stub server on a free local port in a daemon thread """
+
+    def __init__(self, latency=0.02):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.latency = latency
+        self.server.calls = 0
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def calls(self):
+        return self.server.calls
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,110 @@
+"""
+Deterministic synthetic data for the benchmarks: an ingredient library, CKEditor-style recipe HTML and pantry CSVs.
+Everything is drawn from a seeded random.Random, so the same scale and seed always produce the same data
+"""
+import csv
+import io
+import random
+
+# Sizes at scale 1; each scale multiplies them
+BASE = {
+    "library": 1000,
+    "users": 4,
+    "categories": 5,
+    "recipes": 40,
+    "pantry": 60,
+}
+
+COMMON = [
+    "Garlic", "Onion", "Red Onion", "Shallot", "Ginger", "Olive Oil", "Extra-Virgin Olive Oil", "Butter",
+    "Unsalted Butter", "Salt", "Kosher Salt", "Black Pepper", "Sugar", "Brown Sugar", "Flour", "All-Purpose Flour",
+    "Egg", "Milk", "Heavy Cream", "Parmesan Cheese", "Mozzarella", "Cheddar Cheese", "Chicken Breast",
+    "Chicken Thigh", "Ground Beef", "Bacon", "Tomato", "Cherry Tomatoes", "Tomato Paste", "Basil", "Parsley",
+    "Cilantro", "Thyme", "Rosemary", "Oregano", "Paprika", "Smoked Paprika", "Cumin", "Chili Flakes", "Lemon",
+    "Lemon Juice", "Lime", "Soy Sauce", "Rice", "Jasmine Rice", "Pasta", "Spaghetti", "Potato", "Sweet Potato",
+    "Carrot", "Celery", "Spinach", "Mushroom", "Bell Pepper", "Zucchini", "Broccoli", "Honey", "Vinegar",
+    "Balsamic Vinegar", "Chicken Stock", "Vegetable Stock", "Coconut Milk", "Black Beans", "Chickpeas",
+]
+SYLLABLES = ["ka", "ro", "mi", "ta", "le", "su", "po", "na", "ve", "li", "do", "ga", "ri", "be", "zu", "co"]
+KINDS = ["Pepper", "Root", "Leaf", "Seed", "Bean", "Berry", "Squash", "Cheese", "Flour", "Sauce", "Oil", "Salt"]
+AMOUNTS = ["1", "2", "1/2", "3/4", "1 1/2", "250 g", "a pinch of", "2 tbsp", "1 cup", "3 cloves"]
+PREPARATION = ["", ", minced", ", chopped", ", finely diced", " (grated)", ", to taste", ", divided", " (optional)"]
+
+
+def library_names(count, rng):
+    """ Common ingredients first, then unique made-up ones such as "Korami Pepper" """
+    names = list(COMMON[:count])
+    seen = set(names)
+    while len(names) < count:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+        name = f"{word} {rng.choice(KINDS)}"
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def recipe_html(names, rng, low=8, high=15):
+    """ An ingredient list as CKEditor submits it, with amounts, preparation notes and the occasional stray line """
+    lines = []
+    for name in rng.sample(names, min(len(names), rng.randint(low, high))):
+        text = f"{rng.choice(AMOUNTS)} {name.lower() if rng.random() < 0.3 else name}{rng.choice(PREPARATION)}"
+        lines.append(f"\t<li>{text}</li>")
+    if rng.random() < 0.3:
+        lines.append("\t<li>Water as needed &amp; ice</li>")
+    return "<ul>\r\n" + "\r\n".join(lines) + "\r\n</ul>"
+
+
+def directions_html(rng, steps=6):
+    return "<ol>\r\n" + "\r\n".join(
+        f"\t<li><strong>Step {step}.</strong> Stir for {rng.randint(1, 20)} minutes.</li>"
+        for step in range(1, steps + 1)
+    ) + "\r\n</ol>"
+
+
+def csv_bytes(names):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["Ingredient"])
+    writer.writerows([name] for name in names)
+    return buffer.getvalue().encode("utf-8")
+
+
+class Dataset:
+    """
+    Library plus categories, recipes and pantries for several synthetic users at the given scale. The first user has
+    the full per-user sizes and is the one the single-user benchmarks run as, the others get a random share of them,
+    so per-user caches and indexes see many users of different sizes
+    """
+
+    def __init__(self, scale=1, seed=0):
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.library = library_names(BASE["library"] * scale, self.rng)
+        # Recipes draw mostly from the common ingredients, the way real cooking does
+        self.cooking = self.library[:max(len(COMMON), len(self.library) // 10)]
+        self.users = [self.user(0, BASE["recipes"] * scale, BASE["pantry"] * scale)]
+        self.users.extend(
+            self.user(i, self.rng.randint(1, BASE["recipes"]), self.rng.randint(1, BASE["pantry"]))
+            for i in range(1, BASE["users"] * scale)
+        )
+        self.categories = self.users[0]["categories"]
+        self.recipes = self.users[0]["recipes"]
+        self.pantry = self.users[0]["pantry"]
+
+    def user(self, index, recipes, pantry):
+        categories = [f"Category {i}" for i in range(BASE["categories"])]
+        return {
+            "email": f"user{index}@example.com",
+            "categories": categories,
+            "recipes": [
+                {
+                    "name": f"Recipe {i}",
+                    "category": categories[i % len(categories)],
+                    "ingredients": recipe_html(self.cooking, self.rng),
+                    "directions": directions_html(self.rng),
+                }
+                for i in range(recipes)
+            ],
+            "pantry": self.rng.sample(self.cooking, min(len(self.cooking), pantry)),
+        }
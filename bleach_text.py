@@ -1,22 +1,50 @@
 import bleach
+import hashlib
+import threading
+from functools import lru_cache
+
+ALLOW_TAGS = frozenset([
+    'a', 'abbr', 'acronym', 'b', 'blockquote', 'br', 'code', 'dd', 'del', 'div', 'dl', 'dt', 'em', 'h1',
+    'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub',
+    'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul'
+])
+ALLOW_ATTRS = {
+    "*": ['class'],
+    "a": ["href", "rel", "title"],
+    "abbr": ["title"],
+    "acronym": ["title"],
+    "img": ["alt", "src", "style", "width", "height"]
+}
+
+
+def content_hash(s):
+    """ Fingerprint of the submitted text, stored so an unchanged field can be recognized on the next save """
+    return hashlib.sha256((s or "").encode("utf-8")).hexdigest()
+
 
 class Bleach:
-    """ The object permits specified HTML tags and attributes entered into the database """
+    """
+    The object permits specified HTML tags and attributes entered into the database. The cleaner is built once per
+    thread, since bleach's Cleaner is not thread-safe, and recently cleaned text is served from a memo cache
+    """
 
-    def __init__(self, app):
+    def __init__(self, app=None, cache_size=256):
         self.app = app
+        self.local = threading.local()
+        self.cached = lru_cache(maxsize=cache_size)(self._clean)
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def cleaner(self):
+        cleaner = getattr(self.local, "cleaner", None)
+        if cleaner is None:
+            cleaner = self.local.cleaner = bleach.Cleaner(tags=ALLOW_TAGS, attributes=ALLOW_ATTRS)
+        return cleaner
+
+    def _clean(self, s):
+        return self.cleaner.clean(s)
 
     def clean_text(self, s):
-        allow_tags = [
-            'a', 'abbr', 'acronym', 'b', 'blockquote', 'br', 'code', 'dd', 'del', 'div', 'dl', 'dt', 'em', 'h1',
-            'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub',
-            'sup', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'ul'
-        ]
-        allow_attrs = {
-            "*": ['class'],
-            "a": ["href", "rel", "title"],
-            "abbr": ["title"],
-            "acronym": ["title"],
-            "img": ["alt", "src", "style", "width", "height"]
-        }
-        return bleach.clean(s, tags=allow_tags, attributes=allow_attrs)
\ No newline at end of file
+        return self.cached(s)
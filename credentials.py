@@ -0,0 +1,106 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+
+class CredentialsBusy(Exception):
+    """ Raised when the hashing pool already has as many passwords queued as it allows """
+
+
+class Credentials:
+    """
+    The object hashes and checks passwords under the configured policy, PASSWORD_HASH_METHOD in werkzeug's
+    "pbkdf2:<algorithm>:<iterations>" form. The work runs in a pool of PASSWORD_HASH_WORKERS processes per application
+    process, one by default, so request threads only wait on the result while hashing runs elsewhere, and at most
+    PASSWORD_HASH_PENDING passwords are queued before new ones are turned away. Stored hashes record the policy they
+    were made under, so logins can rehash passwords whenever it changes
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.method = f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}"
+        self.salt_length = 16
+        self.workers = 0
+        self.timeout = None
+        self.pool = None
+        self.pool_pid = None
+        self.slots = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        method = app.config.get("PASSWORD_HASH_METHOD", self.method)
+        if method.startswith("pbkdf2:") and method.count(":") == 1:
+            method = f"{method}:{DEFAULT_PBKDF2_ITERATIONS}"
+        self.method = method
+        self.salt_length = app.config.get("PASSWORD_SALT_LENGTH", self.salt_length)
+        # Each gunicorn worker starts its own pool, so W workers run W * PASSWORD_HASH_WORKERS hashing processes
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", 1)
+        self.timeout = app.config.get("PASSWORD_HASH_TIMEOUT", 10)
+        self.slots = threading.BoundedSemaphore(app.config.get("PASSWORD_HASH_PENDING", 4 * max(self.workers, 1)))
+        self.shutdown()
+
+    def _executor(self):
+        """ The pool is started on first use in each process, so workers forked by gunicorn never share one """
+        with self.lock:
+            if self.pool is None or self.pool_pid != os.getpid():
+                # forkserver children start from a clean process rather than a copy of a threaded worker
+                self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("forkserver"))
+                self.pool_pid = os.getpid()
+            return self.pool
+
+    def shutdown(self, pool=None):
+        """ Stops the pool, or only the given pool if it is still the current one """
+        with self.lock:
+            if pool is not None and pool is not self.pool:
+                return
+            if self.pool is not None and self.pool_pid == os.getpid():
+                self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def _submit(self, fn, *args):
+        pool = self._executor()
+        try:
+            return pool.submit(fn, *args).result(self.timeout)
+        except BrokenProcessPool:
+            self.shutdown(pool)
+            raise
+
+    def _run(self, fn, *args):
+        """
+        Runs the call in the pool. A pool that has lost a process or could not start one is replaced and the call tried
+        once more, and if that pool breaks as well the request is turned away like a full queue
+        """
+        if not self.workers:
+            return fn(*args)
+        if not self.slots.acquire(timeout=self.timeout):
+            raise CredentialsBusy("Too many passwords are waiting to be hashed")
+        try:
+            try:
+                return self._submit(fn, *args)
+            except BrokenProcessPool as error:
+                self.app.logger.warning("Restarting the password hashing pool: %s", error)
+                return self._submit(fn, *args)
+        except FutureTimeout as error:
+            raise CredentialsBusy("Hashing the password took too long") from error
+        except BrokenProcessPool as error:
+            raise CredentialsBusy("The password hashing pool is unavailable") from error
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        """ Returns the stored form of the password under the current policy """
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, stored, password):
+        """ Checks the password against a stored hash made under any policy """
+        return self._run(check_password_hash, stored, password)
+
+    def needs_rehash(self, stored):
+        """ Whether the stored hash was made under a different policy than the current one """
+        return stored.split("$", 1)[0] != self.method
@@ -1,33 +1,219 @@
+import io
+import codecs
 import os
+import re
 import csv
-from ingredient_trie import Trie
+import time
+from datetime import date, datetime, timezone
+
+LIBRARY_VERSION = re.compile(r"_(\d{4}-\d{2}-\d{2})\.csv$")
 
 
 class CSVHandler:
-    """ The object handles CSV manipulation and content """
+    """
+    The object keeps the ingredient library in the database, one row per ingredient of every uploaded file, so each
+    worker on each node loads the same library. Uploads are bulk loaded with COPY on PostgreSQL and batched
+    executemany elsewhere, the Trie is built from a streaming query over the newest file and past files are streamed
+    back out as CSV
+    """
 
-    def __init__(self, app, trie):
+    def __init__(self, app=None, trie=None, db=None, models_of=None):
         self.app = app
         self.trie = trie
+        self.db = db
+        # Called for the file and row models on first use, since the extensions are created before the models
+        self.models_of = models_of
+        self.batch_size = 5000
+        self.version = None
+        self.checked = None
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get("LIBRARY_BATCH_SIZE", self.batch_size)
+
+    def library_files(self):
+        """ Returns the names of the uploaded library files ordered from oldest to newest """
+        library_file, _ = self.models_of()
+        return list(self.db.session.scalars(self.db.select(library_file.filename).order_by(library_file.id)))
+
+    def latest_version(self):
+        """ Identifies the newest library by its ID and upload time, which a re-upload of the same file changes """
+        library_file, _ = self.models_of()
+        row = self.db.session.execute(self.db.select(library_file.id, library_file.uploaded)
+                                      .order_by(library_file.id.desc()).limit(1)).first()
+        return tuple(row) if row is not None else None
+
+    def load_library(self):
+        """
+        Swaps in the Trie for the newest library only when the library version has changed. A snapshot built by
+        another worker for the same version is mapped directly, otherwise the names are streamed from the database
+        and the snapshot rewritten
+        """
+        version = self.latest_version()
+        if version is None or version == self.version:
+            return False
+
+        tag = f"{version[0]}:{version[1].isoformat()}"
+        snapshot = self.app.config["TRIE_SNAPSHOT"]
+        if self.trie.load(snapshot, tag) != tag:
+            self.trie.rebuild(name.title() for name in self._sorted_names(version[0]))
+            self.trie.save(snapshot, tag)
+            self.trie.load(snapshot, tag)
+        self.trie.build_index()
+        self.version = version
+        return True
+
+    def refresh(self):
+        """
+        Loads the newest library on first use and picks up libraries uploaded through other workers afterwards,
+        checking the database at most once every LIBRARY_CHECK_INTERVAL seconds
+        """
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.app.config.get("LIBRARY_CHECK_INTERVAL", 5):
+            return False
+        self.checked = now
+        return self.load_library()
+
+    def _sorted_names(self, file_id):
+        """ Streams a file's names in sorted order, which the (file_id, name) index returns without sorting """
+        _, library_ingredient = self.models_of()
+        return self.db.session.scalars(
+            self.db.select(library_ingredient.name).where(library_ingredient.file_id == file_id)
+            .order_by(library_ingredient.name).execution_options(yield_per=self.batch_size)
+        )
+
+    def import_library(self, stream, filename):
+        """
+        Bulk loads an uploaded library straight from its stream and commits it as the newest version, replacing an
+        earlier upload with the same filename. Returns the number of ingredients loaded
+        """
+        library_file, library_ingredient = self.models_of()
+        names = self._read_library(stream)
+        self.db.session.execute(self.db.delete(library_ingredient).where(
+            library_ingredient.file_id.in_(self.db.select(library_file.id).where(library_file.filename == filename))
+        ))
+        self.db.session.execute(self.db.delete(library_file).where(library_file.filename == filename))
+        file = library_file(filename=filename, uploaded=datetime.now(timezone.utc).replace(tzinfo=None))
+        self.db.session.add(file)
+        self.db.session.flush()
+
+        connection = self.db.session.connection()
+        count = 0
+        batch = []
+        for name in names:
+            batch.append((file.id, count, name))
+            count += 1
+            if len(batch) == self.batch_size:
+                self._insert(connection, library_ingredient.__table__, batch)
+                batch = []
+        if batch:
+            self._insert(connection, library_ingredient.__table__, batch)
+        file.row_count = count
+        self.db.session.commit()
+        return count
+
+    def import_files(self):
+        """ Loads the dated library files left in UPLOAD_FOLDER by earlier versions, skipping those already loaded """
+        folder = self.app.config["UPLOAD_FOLDER"]
+        if not os.path.isdir(folder):
+            return
+        loaded = set(self.library_files())
+        versions = []
+        for filename in os.listdir(folder):
+            match = LIBRARY_VERSION.search(filename)
+            if match and filename not in loaded:
+                versions.append((date.fromisoformat(match.group(1)), filename))
+        for _, filename in sorted(versions):
+            with open(os.path.join(folder, filename), "rb") as file:
+                self.import_library(file, filename)
+
+    @staticmethod
+    def _insert(connection, table, batch):
+        """ Writes a batch of rows with COPY on PostgreSQL and a single executemany INSERT elsewhere """
+        if connection.dialect.name == "postgresql":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(batch)
+            buffer.seek(0)
+            with connection.connection.driver_connection.cursor() as cursor:
+                cursor.copy_expert(f"COPY {table.name} (file_id, position, name) FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            connection.execute(table.insert(), [{"file_id": file_id, "position": position, "name": name}
+                                                for file_id, position, name in batch])
+
+    @staticmethod
+    def _read_library(stream):
+        """ Checks the header of an uploaded library and returns an iterator over its non-blank Ingredient names """
+        reader = csv.reader(codecs.iterdecode(stream, "utf-8-sig"))
+        try:
+            header = next(reader, [])
+        except UnicodeDecodeError as error:
+            raise ValueError("The csv file must be UTF-8 encoded") from error
+        if "Ingredient" not in header:
+            raise ValueError('The csv file needs a column labeled "Ingredient"')
+        column = header.index("Ingredient")
 
-    def load_csv(self):
-        files = os.listdir(self.app.config["UPLOAD_FOLDER"])
-        if files:
-            with open(f"{self.app.config['UPLOAD_FOLDER']}/{files[-1]}", newline='') as file:
-                ingredients = csv.DictReader(file)
+        def names():
+            try:
+                for row in reader:
+                    name = row[column].strip() if column < len(row) else ""
+                    if name:
+                        yield name
+            except UnicodeDecodeError as error:
+                raise ValueError("The csv file must be UTF-8 encoded") from error
+        return names()
 
-                for row in ingredients:
-                    self.trie.add_word(row["Ingredient"].title())
+    def download_csv(self, filename):
+        """ Streams a past library file as CSV in its original row order, or returns None if there is no such file """
+        library_file, library_ingredient = self.models_of()
+        file_id = self.db.session.scalar(self.db.select(library_file.id).where(library_file.filename == filename))
+        if file_id is None:
+            return None
 
-    def download_csv(self):
-        files = os.listdir(self.app.config["UPLOAD_FOLDER"])
-        return files
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(["Ingredient"])
+            names = self.db.session.scalars(
+                self.db.select(library_ingredient.name).where(library_ingredient.file_id == file_id)
+                .order_by(library_ingredient.position).execution_options(yield_per=self.batch_size)
+            )
+            for partition in names.partitions():
+                writer.writerows([name] for name in partition)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        return generate()
 
-    def process_csv(self, filename):
-        with open(f"static/user_files/{filename}", newline='') as file:
-            ingredient = csv.DictReader(file)
+    def read_ingredients(self, stream, chunk_size=1000):
+        """
+        Parses an uploaded csv straight from the request stream and yields chunks of normalized ingredient names,
+        skipping blanks and names already seen earlier in the file. Names matching a library ingredient apart from case,
+        plurals and hyphens take the library's spelling so they match the ingredients extracted from recipes
+        """
+        # Decoded line by line, since io.TextIOWrapper rejects the SpooledTemporaryFile uploads arrive in before 3.11
+        ingredients = csv.DictReader(codecs.iterdecode(stream, "utf-8-sig"))
+        try:
+            fieldnames = ingredients.fieldnames or []
+        except UnicodeDecodeError as error:
+            raise ValueError("The csv file must be UTF-8 encoded") from error
+        if "Ingredient" not in fieldnames:
+            raise ValueError('The csv file needs a column labeled "Ingredient"')
 
-            ingredient_set = set()
-            for row in ingredient:
-                ingredient_set.add(row["Ingredient"].title())
-            return ingredient_set
+        seen = set()
+        chunk = []
+        try:
+            for row in ingredients:
+                name = (row["Ingredient"] or "").strip().title()
+                if name:
+                    name = self.trie.lookup(name) or name
+                if name and name not in seen:
+                    seen.add(name)
+                    chunk.append(name)
+                    if len(chunk) == chunk_size:
+                        yield chunk
+                        chunk = []
+        except UnicodeDecodeError as error:
+            raise ValueError("The csv file must be UTF-8 encoded") from error
+        if chunk:
+            yield chunk
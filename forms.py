@@ -49,6 +49,11 @@ class AddToWeek(FlaskForm):
     submit = SubmitField(label="Schedule")
 
 
+class PlanWeek(FlaskForm):
+    """ Provides the button for users to fill their current week with recipes """
+    submit = SubmitField(label="Plan My Week")
+
+
 class LibraryFileForm(FlaskForm):
     """ Provides an upload field for administrators / users to upload their csv files """
     file = FileField(label="Upload",
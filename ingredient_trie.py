@@ -1,20 +1,321 @@
+import os
+import re
+import mmap
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from heapq import nlargest
+from html import unescape
+from collections import deque
+from functools import lru_cache
+
+HTML_TAG = re.compile(r"<[^>]*>")
+BLOCK_TAG = re.compile(r"<\s*/?\s*(?:p|div|li|ul|ol|br|h[1-6]|tr|td|th|table|blockquote|pre)\b[^>]*>", re.IGNORECASE)
+WORD = re.compile(r"[^\W_]+")
+FRAGMENT = re.compile(r"[\n,;()]")
+
+SNAPSHOT_MAGIC = b"ITRI"
+SNAPSHOT_HEADER = struct.Struct("=4sIII")
+
+
+def plain_text(html):
+    """
+    Reduces CKEditor HTML to its text, decoding entities. Block tags and line breaks become newlines so every
+    paragraph or list item stays its own fragment, other tags become spaces
+    """
+    return unescape(HTML_TAG.sub(" ", BLOCK_TAG.sub("\n", html))).replace("\xa0", " ")
+
+
+def singular(word):
+    """
+    Strips common English plural endings. Singular and plural forms only need to end up the same, not correct, so
+    "cheese" and "cheeses" both become "chees"
+    """
+    if len(word) <= 3:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("ie"):
+        return word[:-2] + "y"
+    if word.endswith("es") and word[:-2].endswith(("s", "x", "z", "ch", "sh", "o")):
+        return word[:-2]
+    if word.endswith("e") and word[:-1].endswith(("s", "x", "z", "ch", "sh")):
+        return word[:-1]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def normalize(text):
+    """ Lower-cases the text, treats hyphens and punctuation as spaces and makes every word singular """
+    return " ".join(singular(word) for word in WORD.findall(text.lower()))
+
+
+def allowed_edits(key, max_distance):
+    """ Short names must match almost exactly: one edit from 6 characters and two from 10 """
+    return max(0, min(max_distance, (len(key) - 2) // 4))
+
+
+def _next_row(row, word, c, depth, max_distance):
+    """
+    The next Levenshtein DP row after appending character c to a trie path of the given depth. Only the cells within
+    max_distance of the diagonal are computed, the rest are left at max_distance + 1 since they can never be within it
+    """
+    over = max_distance + 1
+    new = [over] * (len(word) + 1)
+    if depth <= max_distance:
+        new[0] = depth
+    for i in range(max(1, depth - max_distance), min(len(word), depth + max_distance) + 1):
+        new[i] = min(new[i - 1] + 1, row[i] + 1, row[i - 1] + (word[i - 1] != c), over)
+    return new
+
+
 class TrieNode:
     """ The object creates Trie nodes """
 
+    __slots__ = ("children", "is_word")
+
     def __init__(self):
         self.children = {}
         self.is_word = False
 
 
+class IngredientMatcher:
+    """
+    The object compiles a set of words into an Aho-Corasick automaton so every word can be found in a block of
+    text with a single scan. Matching is case-insensitive and only whole words are reported. The goto function is
+    a CompactTrie of the words and the failure links, dictionary links and depths are flat arrays indexed by its
+    nodes, so the automaton is a handful of buffers rather than a dict per state
+    """
+
+    def __init__(self, words):
+        self.keys = CompactTrie()
+        self.keys.rebuild(word.lower() for word in words)
+        first, labels, terminal = self.keys.nodes
+        self.fail = array("I", bytes(4 * len(terminal)))
+        self.dict_link = array("I", bytes(4 * len(terminal)))
+        self.depth = array("I", bytes(4 * len(terminal)))
+
+        # Nodes are numbered breadth first, so a node's failure link is always set before its children need it.
+        # Each state also links to the nearest suffix state that completes a word, so outputs are walked in
+        # O(matches)
+        for state in range(len(terminal)):
+            for child in range(first[state], first[state + 1]):
+                self.depth[child] = self.depth[state] + 1
+                if state == 0:
+                    continue
+                link = self._goto(self.fail[state], labels[child])
+                self.fail[child] = link
+                self.dict_link[child] = link if terminal[link] else self.dict_link[link]
+
+    def _goto(self, state, label):
+        """ Follows the failure links from state until one has a transition on the label """
+        first, labels, _ = self.keys.nodes
+        while True:
+            lo, hi = first[state], first[state + 1]
+            child = bisect_left(labels, label, lo, hi)
+            if child < hi and labels[child] == label:
+                return child
+            if not state:
+                return 0
+            state = self.fail[state]
+
+    def find(self, text):
+        """ Returns every whole-word match in the text as (start, end, word), preferring the leftmost-longest match """
+        text = text.lower()
+        terminal = self.keys.nodes[2]
+        candidates = []
+        state = 0
+
+        for i, c in enumerate(text):
+            state = self._goto(state, ord(c))
+
+            match = state if terminal[state] else self.dict_link[state]
+            while match:
+                start = i - self.depth[match] + 1
+                if self._is_boundary(text, start - 1) and self._is_boundary(text, i + 1):
+                    candidates.append((start, i + 1, text[start:i + 1]))
+                match = self.dict_link[match]
+
+        candidates.sort(key=lambda m: (m[0], m[0] - m[1]))
+        matches = []
+        end = 0
+        for candidate in candidates:
+            if candidate[0] >= end:
+                matches.append(candidate)
+                end = candidate[1]
+        return matches
+
+    @staticmethod
+    def _is_boundary(text, i):
+        return i < 0 or i >= len(text) or not text[i].isalnum()
+
+
+class IngredientIndex:
+    """
+    The object finds library ingredients in recipe text. Names and text are both normalized, so plurals, case and
+    hyphens do not matter, and the normalized names are matched exactly in one Aho-Corasick pass. The words left
+    between exact matches are then matched against the normalized names within a bounded edit distance
+    """
+
+    def __init__(self, words):
+        self.names = {}
+        for word in words:
+            self.names.setdefault(normalize(word), word)
+        self.matcher = IngredientMatcher(self.names)
+        self.keys = self.matcher.keys
+        self.closest = lru_cache(maxsize=4096)(self._closest)
+
+    def _closest(self, key, max_distance, whole_words=False):
+        """
+        The library name nearest to a normalized key, cached since modifiers like "to taste" recur everywhere. With
+        whole_words the name must also agree with the key word for word
+        """
+        allowed = allowed_edits(key, max_distance)
+        for match, _ in self.keys.fuzzy(key, allowed) if allowed else []:
+            if not whole_words or self._agrees(key, match):
+                return self.names[match]
+        return None
+
+    @staticmethod
+    def _agrees(key, name):
+        """
+        Recipe text is full of words a typo away from some ingredient, so a typo there only counts beside a word that
+        matches exactly, and only if it does not just shorten or lengthen a word. "parmesan chese" is Parmesan Cheese
+        but "batter" is not Butter and "chicken brother" is not Chicken Broth
+        """
+        words, name_words = key.split(), name.split()
+        if len(words) != len(name_words):
+            return False
+        differing = [(word, name_word) for word, name_word in zip(words, name_words) if word != name_word]
+        return len(differing) < len(words) and not any(
+            word.startswith(name_word) or name_word.startswith(word) for word, name_word in differing
+        )
+
+    def lookup(self, name, max_distance=0):
+        """ Returns the library name for the given name, or the closest one within the allowed edits, or None """
+        key = normalize(name)
+        if key in self.names:
+            return self.names[key]
+        return self.closest(key, max_distance)
+
+    def find(self, text, max_distance=0, max_words=4):
+        """
+        Returns the library names in the text in order of appearance. With max_distance, the words around and
+        between the exact matches of each fragment are matched with typos allowed
+        """
+        found = []
+        for fragment in FRAGMENT.split(text):
+            key = normalize(fragment)
+            covered = 0
+            for start, end, word in self.matcher.find(key):
+                if max_distance:
+                    found.extend(self._fuzzy_find(key[covered:start].split(), max_distance, max_words))
+                found.append(self.names[word])
+                covered = end
+            if max_distance:
+                found.extend(self._fuzzy_find(key[covered:].split(), max_distance, max_words))
+        return found
+
+    def _fuzzy_find(self, tokens, max_distance, max_words):
+        """ Matches the longest runs of words from the left, skipping numbers """
+        found = []
+        i = 0
+        while i < len(tokens):
+            for n in range(min(max_words, len(tokens) - i), 0, -1):
+                phrase = tokens[i:i + n]
+                if not all(token.isalpha() for token in phrase):
+                    continue
+                name = self.closest(" ".join(phrase), max_distance, True)
+                if name is not None:
+                    found.append(name)
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+
+class RankedCompleter:
+    """
+    The object returns the highest weighted completions of a prefix. Words are kept sorted so every prefix covers a
+    contiguous run of them. Runs longer than scan_limit have their top completions precomputed, shorter runs are
+    ranked on demand, so any lookup touches at most scan_limit words
+    """
+
+    def __init__(self, weights, limit=10, scan_limit=64):
+        self.words = sorted(weights)
+        self.weights = [weights[word] for word in self.words]
+        self.limit = limit
+        self.scan_limit = scan_limit
+        self.top = {}
+
+        stack = [(0, len(self.words), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo <= scan_limit:
+                continue
+            self.top[self.words[lo][:depth]] = self._rank(lo, hi, limit)
+
+            i = lo + 1 if len(self.words[lo]) == depth else lo
+            while i < hi:
+                c = self.words[i][depth]
+                j = i
+                while j < hi and self.words[j][depth] == c:
+                    j += 1
+                stack.append((i, j, depth + 1))
+                i = j
+
+    def _rank(self, lo, hi, limit):
+        ranked = nlargest(limit, range(lo, hi), key=lambda i: (self.weights[i], -i))
+        return [(self.words[i], self.weights[i]) for i in ranked]
+
+    def weight(self, word):
+        i = bisect_left(self.words, word)
+        return self.weights[i] if i < len(self.words) and self.words[i] == word else 0
+
+    def complete(self, prefix, limit=None):
+        """ Returns up to limit (word, weight) pairs starting with the prefix, highest weight first """
+        limit = min(limit or self.limit, self.limit)
+        lo = bisect_left(self.words, prefix)
+        hi = bisect_left(self.words, prefix + "\U0010ffff", lo)
+        if hi - lo > self.scan_limit:
+            return self.top[prefix][:limit]
+        return self._rank(lo, hi, limit)
+
+
 class Trie:
     """ The object manages Trie data by adding words to the data structure and recalling existing words/prefixes """
 
-    def __init__(self, app):
+    def __init__(self, app=None):
         self.app = app
         self.root = TrieNode()
+        self.index = None
+        self.lock = threading.Lock()
+        self.max_edits = 2
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_edits = app.config.get("INGREDIENT_MAX_EDITS", 2)
+
+    def rebuild(self, words):
+        """ Builds a fresh root from the given words and swaps it in, so lookups never see a partial Trie """
+        root = TrieNode()
+        for word in words:
+            self._insert(root, word)
+        self.root = root
+        self.index = None
 
     def add_word(self, word):
-        cur = self.root
+        self._insert(self.root, word)
+        self.index = None
+
+    @staticmethod
+    def _insert(root, word):
+        cur = root
 
         for c in word:
             if c not in cur.children:
@@ -39,3 +340,212 @@ class Trie:
                 return False
             cur = cur.children[c]
         return cur.is_word
+
+    def words(self):
+        """ Yields every word stored in the Trie """
+        stack = [(self.root, "")]
+        while stack:
+            node, prefix = stack.pop()
+            if node.is_word:
+                yield prefix
+            for c, child in node.children.items():
+                stack.append((child, prefix + c))
+
+    def fuzzy(self, word, max_distance=1):
+        """
+        Returns (stored word, distance) for every word within max_distance edits, closest first. The Trie is walked
+        one Levenshtein DP row per character and a branch is abandoned once every cell of its row is too large
+        """
+        results = []
+        stack = [(self.root, "", list(range(len(word) + 1)))]
+        while stack:
+            node, prefix, row = stack.pop()
+            if node.is_word and row[-1] <= max_distance:
+                results.append((prefix, row[-1]))
+            for c, child in node.children.items():
+                new = _next_row(row, word, c, len(prefix) + 1, max_distance)
+                if min(new) <= max_distance:
+                    stack.append((child, prefix + c, new))
+        return sorted(results, key=lambda result: (result[1], result[0]))
+
+    def _index(self):
+        index = self.index
+        if index is None:
+            # Concurrent requests wait for a single build rather than each building their own
+            with self.lock:
+                if self.index is None:
+                    self.index = IngredientIndex(self.words())
+                index = self.index
+        return index
+
+    def build_index(self):
+        """
+        Builds the index used by lookup and extract ahead of the first request that needs it. Done while preloading,
+        the workers inherit it from the master
+        """
+        self._index()
+
+    def lookup(self, name, max_distance=0):
+        """
+        Returns the library spelling of an ingredient name, tolerating case, plurals and hyphens, or None. Typos are
+        only tolerated when max_distance allows edits, since a name typed on its own may be a different ingredient
+        that happens to be spelled closely, like "Batter" and "Butter"
+        """
+        return self._index().lookup(name, max_distance)
+
+    def extract(self, text, max_distance=None):
+        """
+        Finds every library ingredient within the recipe's ingredient HTML and returns the unique names in order of
+        appearance. Exact matches are found in one pass and the words left between them are matched with typos
+        allowed
+        """
+        max_distance = self.max_edits if max_distance is None else max_distance
+        return list(dict.fromkeys(self._index().find(plain_text(text), max_distance)))
+
+
+class CompactTrie(Trie):
+    """
+    The object stores the Trie as flat arrays in breadth-first order instead of a Python object per character.
+    Node i's children sit in the slots first[i]..first[i + 1] with their characters kept sorted in labels, so a
+    lookup is a binary search per character. The arrays can be saved to a snapshot file and mapped read-only,
+    letting every worker process share a single copy from the page cache
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.index = None
+        self.lock = threading.Lock()
+        self.max_edits = 2
+        self.rebuild([])
+        if app is not None:
+            self.init_app(app)
+
+    def rebuild(self, words):
+        """ Builds the arrays from the given words and swaps them in, so lookups never see a partial Trie """
+        words = sorted(set(words))
+        first, labels, terminal = array("I"), array("I", [0]), bytearray()
+
+        # Each queued node covers the run of sorted words sharing its prefix of the given depth
+        queue = deque([(0, len(words), 0)])
+        while queue:
+            lo, hi, depth = queue.popleft()
+            first.append(len(labels))
+            terminal.append(lo < hi and len(words[lo]) == depth)
+
+            i = lo + 1 if lo < hi and len(words[lo]) == depth else lo
+            while i < hi:
+                c = words[i][depth]
+                j = i
+                while j < hi and words[j][depth] == c:
+                    j += 1
+                labels.append(ord(c))
+                queue.append((i, j, depth + 1))
+                i = j
+        first.append(len(labels))
+
+        self.nodes = (first, labels, terminal)
+        self.snapshot = None
+        self.index = None
+
+    def add_word(self, word):
+        """ The arrays are immutable, so adding a word rebuilds them """
+        self.rebuild([*self.words(), word])
+
+    def _walk(self, word):
+        first, labels, _ = self.nodes
+        node = 0
+
+        for c in word:
+            lo, hi = first[node], first[node + 1]
+            node = bisect_left(labels, ord(c), lo, hi)
+            if node == hi or labels[node] != ord(c):
+                return None
+        return node
+
+    def get_prefix(self, word):
+        return self._walk(word) is not None
+
+    def search(self, word):
+        node = self._walk(word)
+        return node is not None and bool(self.nodes[2][node])
+
+    def words(self):
+        """ Yields every word stored in the Trie in sorted order """
+        first, labels, terminal = self.nodes
+        stack = [(0, "")]
+        while stack:
+            node, prefix = stack.pop()
+            if terminal[node]:
+                yield prefix
+            for child in reversed(range(first[node], first[node + 1])):
+                stack.append((child, prefix + chr(labels[child])))
+
+    def fuzzy(self, word, max_distance=1):
+        first, labels, terminal = self.nodes
+        results = []
+        stack = [(0, "", list(range(len(word) + 1)))]
+        while stack:
+            node, prefix, row = stack.pop()
+            if terminal[node] and row[-1] <= max_distance:
+                results.append((prefix, row[-1]))
+            for child in range(first[node], first[node + 1]):
+                c = chr(labels[child])
+                new = _next_row(row, word, c, len(prefix) + 1, max_distance)
+                if min(new) <= max_distance:
+                    stack.append((child, prefix + c, new))
+        return sorted(results, key=lambda result: (result[1], result[0]))
+
+    def save(self, path, version):
+        """ Writes the arrays to a snapshot file tagged with the library version it was built from """
+        first, labels, terminal = self.nodes
+        tag = version.encode()
+        padding = b"\0" * (-len(tag) % 4)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 1, len(terminal), len(tag)))
+            file.write(tag + padding)
+            file.write(first.tobytes())
+            file.write(labels.tobytes())
+            file.write(terminal)
+        os.replace(temp_path, path)
+
+    def load(self, path, version=None):
+        """
+        Maps a snapshot file read-only and returns its library version, or None if there is no usable snapshot. Given
+        a version, the arrays are swapped in only when the snapshot's tag matches it, so a stale snapshot never
+        replaces the Trie being served
+        """
+        try:
+            with open(path, "rb") as file:
+                snapshot = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if len(snapshot) < SNAPSHOT_HEADER.size:
+            snapshot.close()
+            return None
+        magic, file_format, count, tag_length = SNAPSHOT_HEADER.unpack_from(snapshot)
+        if magic != SNAPSHOT_MAGIC or file_format != 1:
+            snapshot.close()
+            return None
+
+        offset = SNAPSHOT_HEADER.size
+        tag = snapshot[offset:offset + tag_length].decode()
+        if version is not None and tag != version:
+            snapshot.close()
+            return tag
+
+        view = memoryview(snapshot)
+        offset += tag_length + (-tag_length % 4)
+        first = view[offset:offset + 4 * (count + 1)].cast("I")
+        offset += 4 * (count + 1)
+        labels = view[offset:offset + 4 * count].cast("I")
+        offset += 4 * count
+        terminal = view[offset:offset + count]
+
+        self.nodes = (first, labels, terminal)
+        self.snapshot = snapshot
+        self.index = None
+        return tag
@@ -1,36 +1,88 @@
-from flask import Flask, render_template, redirect, request, url_for, flash, abort, send_from_directory
+from flask import Flask, Blueprint, render_template, redirect, request, url_for, flash, abort, \
+    jsonify, Response, stream_with_context, current_app
 from functools import wraps
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import selectinload, joinedload, with_parent, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects import postgresql, sqlite
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager, UserMixin, login_required, login_user, logout_user, current_user
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
-from forms import RegisterForm, LoginForm, CreateCategory, RecipesForm, AddToWeek, LibraryFileForm, AddIngredient, SearchRecipe
+from forms import RegisterForm, LoginForm, CreateCategory, RecipesForm, AddToWeek, PlanWeek, LibraryFileForm, \
+    AddIngredient, SearchRecipe
 from flask_ckeditor import CKEditor
-from ingredient_trie import Trie
+from ingredient_trie import CompactTrie, normalize
 from recipe_api import RecipeLibrary
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
 from csv_handler import CSVHandler
-import random
+from autocomplete import Autocomplete
+from pantry_matcher import PantryMatcher
+from meal_planner import MealPlanner
+from recipe_search import RecipeSearch
+from page_cache import PageCache, cached_page
+from user_cache import UserCache
+from static_assets import StaticAssets, build as build_assets
+from metrics import Metrics
+from credentials import Credentials, CredentialsBusy
 import os
-from bleach_text import Bleach
+import csv
+import time
+import click
+import io
+import requests
+from bleach_text import Bleach, content_hash
+import migrations
 
-app = Flask(__name__)
-app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
-app.config["UPLOAD_FOLDER"] = "static/files"
+db = SQLAlchemy()
+login_manager = LoginManager()
+bootstrap = Bootstrap()
+ckeditor = CKEditor()
 
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///meals.db")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db = SQLAlchemy(app)
 
-library = RecipeLibrary(app, os.environ.get("SPOON_API"))
-trie = Trie(app)
-csv_handler = CSVHandler(app, trie)
-
-login_manager = LoginManager(app)
-Bootstrap(app)
-ckeditor = CKEditor(app)
-bleach_text = Bleach(app)
+def build_extensions():
+    """
+    Creates the application's own extensions. Every application gets a fresh set, kept in
+    app.extensions["meal_planner"], so one application's library, caches and metrics never leak into another's
+    """
+    trie = CompactTrie()
+    return {
+        "metrics": Metrics(),
+        "library": RecipeLibrary(),
+        "trie": trie,
+        "csv_handler": CSVHandler(trie=trie, db=db, models_of=lambda: (LibraryFile, LibraryIngredient)),
+        "autocomplete": Autocomplete(trie=trie),
+        "pantry_matcher": PantryMatcher(),
+        "meal_planner": MealPlanner(),
+        "page_cache": PageCache(version_of=lambda user: (user.data_version, user.data_changed)),
+        "recipe_search": RecipeSearch(),
+        "credentials": Credentials(),
+        "user_cache": UserCache(db=db, model_of=lambda: User),
+        "static_assets": StaticAssets(),
+        "bleach_text": Bleach(),
+    }
+
+
+def current_extension(name):
+    """ Proxies the current application's instance of one of its own extensions """
+    return LocalProxy(lambda: current_app.extensions["meal_planner"][name])
+
+
+metrics = current_extension("metrics")
+library = current_extension("library")
+trie = current_extension("trie")
+csv_handler = current_extension("csv_handler")
+autocomplete = current_extension("autocomplete")
+pantry_matcher = current_extension("pantry_matcher")
+meal_planner = current_extension("meal_planner")
+page_cache = current_extension("page_cache")
+recipe_search = current_extension("recipe_search")
+credentials = current_extension("credentials")
+user_cache = current_extension("user_cache")
+static_assets = current_extension("static_assets")
+bleach_text = current_extension("bleach_text")
+
+bp = Blueprint("main", __name__, cli_group=None)
 
 
 class User(UserMixin, db.Model):
@@ -45,9 +97,12 @@ class User(UserMixin, db.Model):
     food_categories = db.relationship("Category", back_populates="user")
     recipes = db.relationship("Recipes", back_populates="user")
     my_week = db.relationship("WeeklyMeal", back_populates="user")
-    ingredients = db.relationship("Ingredients", back_populates="user")
     current_ingredients = db.relationship("CurrentIngredients", back_populates="user")
 
+    # Bumped by every write to the user's data, so their cached pages are never served stale
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    data_changed = db.Column(db.DateTime)
+
 
 class Category(db.Model):
     """ Stores and categorizes a group recipes based on the category name assigned """
@@ -67,6 +122,7 @@ class WeeklyMeal(db.Model):
     """ Stores and assigns a recipe to a specific day of the week """
 
     __tablename__ = "weekly_meal"
+    __table_args__ = (db.Index("ix_weekly_meal_user_day", "user_id", "day_of_week", unique=True),)
     id = db.Column(db.Integer, primary_key=True)
     day_of_week = db.Column(db.String(250), nullable=False)
 
@@ -77,8 +133,8 @@ class WeeklyMeal(db.Model):
 
 recipe_to_ingredient = db.Table(
     "recipe_to_ingredient",
-    db.Column("recipe_id", db.Integer, db.ForeignKey("recipes.id")),
-    db.Column("ingredient_id", db.Integer, db.ForeignKey("ingredients.id")),
+    db.Column("recipe_id", db.Integer, db.ForeignKey("recipes.id"), primary_key=True),
+    db.Column("ingredient_id", db.Integer, db.ForeignKey("ingredients.id"), primary_key=True, index=True),
 )
 
 
@@ -93,32 +149,34 @@ class Recipes(db.Model):
     link = db.Column(db.String, nullable=False)
     ingredients = db.Column(db.Text, nullable=False)
     directions = db.Column(db.Text, nullable=False)
+    ingredients_hash = db.Column(db.String(64))
+    directions_hash = db.Column(db.String(64))
 
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), index=True)
     user = db.relationship("User", back_populates="recipes")
 
-    category_id = db.Column(db.Integer, db.ForeignKey("category.id"))
+    category_id = db.Column(db.Integer, db.ForeignKey("category.id"), index=True)
     category = db.relationship("Category", back_populates="recipe")
 
-    my_week_id = db.Column(db.Integer, db.ForeignKey("weekly_meal.id"))
+    my_week_id = db.Column(db.Integer, db.ForeignKey("weekly_meal.id"), index=True)
     my_week = db.relationship("WeeklyMeal", back_populates="my_recipes")
 
     ingredient = db.relationship("Ingredients", secondary=recipe_to_ingredient, backref="recipe")
+    plan_history = db.relationship("PlannedMeal", back_populates="recipe", cascade="all, delete-orphan")
 
 
 class Ingredients(db.Model):
     """
-    Stores related ingredients to a specific recipe based on what the user input in the ingredients field
-    of the Recipes table
+    Stores the ingredient dictionary shared by every user, one row per normalized name, seeded from the ingredient
+    library. Recipes and pantries refer to ingredients by their ID
     """
 
     __tablename__ = "ingredients"
+    __table_args__ = (db.Index("ix_ingredients_key", "key", unique=True),)
     id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(500), nullable=False)
     name = db.Column(db.String(500), nullable=False)
 
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
-    user = db.relationship("User", back_populates="ingredients")
-
     cur_ingrdt = db.relationship("CurrentIngredients", back_populates="ingredient")
 
 
@@ -126,15 +184,114 @@ class CurrentIngredients(db.Model):
     """ Stores a list of ingredients the user has entered based on their current available ingredients """
 
     __tablename__ = "current_ingredients"
+    __table_args__ = (db.Index("ix_current_ingredients_user_ingredient", "user_id", "ingredient_id", unique=True),)
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(500), nullable=False)
 
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     user = db.relationship("User", back_populates="current_ingredients")
 
-    ingredient_id = db.Column(db.Integer, db.ForeignKey("ingredients.id"))
+    ingredient_id = db.Column(db.Integer, db.ForeignKey("ingredients.id"), nullable=False)
     ingredient = db.relationship("Ingredients", back_populates="cur_ingrdt")
 
+    @property
+    def name(self):
+        return self.ingredient.name
+
+
+class LibraryFile(db.Model):
+    """ Stores each ingredient library uploaded by an administrator, the newest one being the library in use """
+
+    __tablename__ = "library_file"
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(250), unique=True, nullable=False)
+    uploaded = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LibraryIngredient(db.Model):
+    """ Stores the ingredient names of a library file in their original order """
+
+    __tablename__ = "library_ingredient"
+    __table_args__ = (db.Index("ix_library_ingredient_file_name", "file_id", "name"),)
+    file_id = db.Column(db.Integer, db.ForeignKey("library_file.id"), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(500), nullable=False)
+
+
+class PlannedMeal(db.Model):
+    """ Records the recipes placed by the meal-plan generator, so the next plans can avoid repeating them """
+
+    __tablename__ = "planned_meal"
+    __table_args__ = (db.Index("ix_planned_meal_user_date", "user_id", "planned_on"),)
+    id = db.Column(db.Integer, primary_key=True)
+    planned_on = db.Column(db.Date, nullable=False)
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+
+    recipe_id = db.Column(db.Integer, db.ForeignKey("recipes.id"), nullable=False)
+    recipe = db.relationship("Recipes", back_populates="plan_history")
+
+
+# Loader options for each page, so a template walks its relationships without issuing a query per row
+PAGE_LOADS = {
+    "my_recipes": [selectinload(Category.recipe)],
+    "my_week": [selectinload(WeeklyMeal.my_recipes)],
+    "my_ingredients": [joinedload(CurrentIngredients.ingredient)],
+    "view_recipe": [joinedload(Recipes.my_week), selectinload(Recipes.ingredient)],
+}
+
+# The user relationship each user page renders
+PAGE_RELATIONSHIPS = {
+    "my_recipes": User.food_categories,
+    "my_week": User.my_week,
+    "my_ingredients": User.current_ingredients,
+}
+
+
+def load_page_user(user_id, page):
+    """
+    Loads the relationship the page renders onto the already loaded user, with its rows' own relationships, rather
+    than selecting the user again
+    """
+    user = user_cache.get(user_id)
+    relationship = PAGE_RELATIONSHIPS[page]
+    rows = db.session.scalars(db.select(relationship.property.mapper.class_)
+                              .where(with_parent(user, relationship)).options(*PAGE_LOADS[page])).all()
+    set_committed_value(user, relationship.key, rows)
+    return user
+
+
+def touch_user_data(user_id):
+    """ Bumps the user's data version within the current transaction, so their cached pages are rendered again """
+    db.session.execute(
+        db.update(User).where(User.id == user_id)
+        .values(data_version=User.data_version + 1, data_changed=datetime.now(timezone.utc).replace(tzinfo=None)),
+        execution_options={"synchronize_session": False}
+    )
+    db.session.info.setdefault("changed_users", set()).add(user_id)
+
+
+@db.event.listens_for(User, "after_update")
+def user_changed(mapper, connection, target):
+    """ Marks users updated through the ORM, such as a rehashed password, for removal from the user cache """
+    object_session(target).info.setdefault("changed_users", set()).add(target.id)
+
+
+@db.event.listens_for(db.session, "after_commit")
+def invalidate_users(session):
+    """ Drops changed users from the user cache once the change is visible to other requests """
+    for user_id in session.info.pop("changed_users", ()):
+        user_cache.invalidate(user_id)
+
+
+@db.event.listens_for(db.session, "after_rollback")
+def forget_changed_users(session):
+    session.info.pop("changed_users", None)
+
+
+def has_recipes(user_id):
+    return db.session.scalar(db.select(db.exists().where(Recipes.user_id == user_id)))
+
 
 @db.event.listens_for(User, "after_insert")
 def insert_day(mapper, connection, target):
@@ -147,14 +304,182 @@ def insert_day(mapper, connection, target):
                                                 user_id=target.id))
 
 
-with app.app_context():
+def init_db():
+    """
+    Creates the tables, brings databases created by older versions up to date, builds the search index, loads library
+    files left in the upload folder and adds the ingredient library to the ingredient dictionary
+    """
     db.create_all()
+    migrations.upgrade(db.engine)
+    recipe_search.setup(db.engine)
+    csv_handler.import_files()
+    csv_handler.refresh()
+    seed_ingredients()
+
+
+@bp.cli.command("init-db")
+def init_db_command():
+    """ Creates or upgrades the database schema """
+    init_db()
+    click.echo("Database is up to date.")
+
+
+@bp.cli.command("build-assets")
+def build_assets_command():
+    """ Writes fingerprinted, resized and precompressed copies of the static assets """
+    manifest = build_assets(current_app.static_folder)
+    click.echo(f"Built {len(manifest['assets'])} assets into static/dist.")
+
+
+@bp.before_app_request
+def refresh_library():
+    """ Loads the ingredient library on first use and picks up newer ones uploaded through any worker """
+    start = time.perf_counter()
+    if csv_handler.refresh():
+        metrics.observe("ingredient_library_load_seconds", time.perf_counter() - start)
 
 
 @login_manager.user_loader
 def load_user(user_id):
     """ Loads an authenticated user """
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
+
+
+def ingredient_counts(user_id=None):
+    """
+    Counts how many recipes use each ingredient name, across all users or for the specified user. Recipes are counted
+    per dictionary row and then added up by name, which is what autocomplete ranks
+    """
+    query = db.session.query(Ingredients.name, db.func.count(recipe_to_ingredient.c.recipe_id)) \
+        .outerjoin(recipe_to_ingredient, recipe_to_ingredient.c.ingredient_id == Ingredients.id)
+    if user_id is not None:
+        query = query.join(Recipes, Recipes.id == recipe_to_ingredient.c.recipe_id).filter(Recipes.user_id == user_id)
+    counts = {}
+    for name, count in query.group_by(Ingredients.id, Ingredients.name):
+        counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+def insert_or_ignore(table, *columns):
+    """ Builds an INSERT that skips rows violating the unique index on the given columns """
+    dialect = postgresql if db.engine.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table).on_conflict_do_nothing(index_elements=columns)
+
+
+def add_ingredients(names):
+    """
+    Adds the names missing from the ingredient dictionary in one statement, relying on the unique index to skip keys
+    that already exist, and returns each name's key. Names that normalize to nothing are left out
+    """
+    keys = {name: key for name in names if (key := normalize(name))}
+    rows = {key: name for name, key in keys.items()}
+    if rows:
+        db.session.execute(insert_or_ignore(Ingredients.__table__, "key"),
+                           [{"key": key, "name": name} for key, name in rows.items()])
+    return keys
+
+
+def ingredient_ids(names):
+    """ Returns the dictionary ID of each name, adding the names not in it yet """
+    keys = add_ingredients(names)
+    if not keys:
+        return {}
+    ids = dict(db.session.execute(db.select(Ingredients.key, Ingredients.id)
+                                  .where(Ingredients.key.in_(set(keys.values())))).all())
+    return {name: ids[key] for name, key in keys.items()}
+
+
+def link_ingredients(recipe, names):
+    """
+    Reconciles the recipe's ingredient links with the recognized names. New links are added and links to ingredients
+    no longer in the text are removed. The caller commits once. Returns the linked ingredient IDs keyed by name and
+    the IDs that were unlinked
+    """
+    db.session.flush()
+    linked = set(db.session.scalars(db.select(recipe_to_ingredient.c.ingredient_id)
+                                    .where(recipe_to_ingredient.c.recipe_id == recipe.id)))
+    ingredient_ids_by_name = ingredient_ids(names)
+
+    added = {ingredient_id for ingredient_id in ingredient_ids_by_name.values() if ingredient_id not in linked}
+    removed = linked - set(ingredient_ids_by_name.values())
+    if added:
+        db.session.execute(insert_or_ignore(recipe_to_ingredient, "recipe_id", "ingredient_id"),
+                           [{"recipe_id": recipe.id, "ingredient_id": ingredient_id} for ingredient_id in added])
+    if removed:
+        db.session.execute(recipe_to_ingredient.delete().where(recipe_to_ingredient.c.recipe_id == recipe.id,
+                                                               recipe_to_ingredient.c.ingredient_id.in_(removed)))
+    if added or removed:
+        db.session.expire(recipe, ["ingredient"])
+    return ingredient_ids_by_name, removed
+
+
+def import_current_ingredients(chunks, user_id):
+    """
+    Adds chunks of ingredient names to the user's current ingredients. Each chunk resolves the names to dictionary
+    IDs, finds the ones already in the pantry with one IN query and inserts the rest together. Returns the IDs added
+    and the number already listed
+    """
+    added, existing = [], 0
+
+    for chunk in chunks:
+        ids = set(ingredient_ids(chunk).values())
+        current = set(db.session.scalars(db.select(CurrentIngredients.ingredient_id)
+                                         .where(CurrentIngredients.user_id == user_id,
+                                                CurrentIngredients.ingredient_id.in_(ids))))
+        new_ids = sorted(ids - current)
+        if new_ids:
+            db.session.execute(insert_or_ignore(CurrentIngredients.__table__, "user_id", "ingredient_id"),
+                               [{"user_id": user_id, "ingredient_id": ingredient_id} for ingredient_id in new_ids])
+        added.extend(new_ids)
+        existing += len(current)
+
+    db.session.commit()
+    return added, existing
+
+
+def seed_ingredients():
+    """ Adds the ingredient library to the ingredient dictionary, so its spelling becomes each ingredient's name """
+    add_ingredients(list(trie.words()))
+    db.session.commit()
+
+
+def load_pantry_index(user_id):
+    """
+    Loads the recipe and pantry data for the pantry matcher with one query per table, bypassing the ORM objects,
+    unless its index already reflects the user's data version
+    """
+    version = user_cache.get(user_id).data_version
+    if pantry_matcher.loaded(user_id, version):
+        return
+    recipes = db.session.execute(db.select(Recipes.id, Recipes.name).where(Recipes.user_id == user_id)).all()
+    links = db.session.execute(
+        db.select(recipe_to_ingredient.c.recipe_id, Ingredients.id, Ingredients.name)
+        .join(Ingredients, Ingredients.id == recipe_to_ingredient.c.ingredient_id)
+        .join(Recipes, Recipes.id == recipe_to_ingredient.c.recipe_id)
+        .where(Recipes.user_id == user_id)
+    ).all()
+    pantry = db.session.scalars(db.select(CurrentIngredients.ingredient_id)
+                                .where(CurrentIngredients.user_id == user_id))
+    pantry_matcher.load(user_id, version, recipes, links, pantry)
+
+
+def shopping_list_query(user_id):
+    """
+    Aggregates every ingredient of the recipes scheduled in the user's week, minus their current ingredients, with
+    the number of scheduled recipes needing each one. Rows are grouped by dictionary ID, since only the key is unique
+    and two ingredients may share a display name
+    """
+    in_pantry = db.select(CurrentIngredients.id).where(
+        CurrentIngredients.user_id == user_id,
+        CurrentIngredients.ingredient_id == Ingredients.id
+    ).exists()
+    return db.select(Ingredients.name, db.func.count(db.distinct(Recipes.id)).label("recipes")) \
+        .join(WeeklyMeal, WeeklyMeal.id == Recipes.my_week_id) \
+        .join(recipe_to_ingredient, recipe_to_ingredient.c.recipe_id == Recipes.id) \
+        .join(Ingredients, Ingredients.id == recipe_to_ingredient.c.ingredient_id) \
+        .where(WeeklyMeal.user_id == user_id, ~in_pantry) \
+        .group_by(Ingredients.id, Ingredients.name) \
+        .order_by(Ingredients.name, Ingredients.id)
 
 
 def admin_only(f):
@@ -177,16 +502,7 @@ def correct_user(f):
     return decorator
 
 
-def load_library(f):
-    """ Loads the most recent ingredient library to the Trie for ingredient recognition """
-    @wraps(f)
-    def decorator(*args, **kwargs):
-        csv_handler.load_csv()
-        return f(*args, **kwargs)
-    return decorator
-
-
-@app.route("/")
+@bp.route("/")
 def home():
     """ Display the home page for users, unauthenticated users are automatically assigned an ID of 0 """
     if not current_user.is_authenticated:
@@ -194,7 +510,7 @@ def home():
     return render_template("index.html", user_id=current_user.id)
 
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     """ Allows users to register an account. If a user already exists, they will be redirected to the login page """
     form = RegisterForm()
@@ -202,13 +518,10 @@ def register():
     if form.validate_on_submit():
         if User.query.filter_by(email=form.email.data).first():
             flash("User already exists. Please login.")
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
 
-        secure_pw = generate_password_hash(
-            form.password.data,
-            method="pbkdf2:sha256",
-            salt_length=12
-        )
+        with metrics.timer("password_hash_seconds", operation="generate"):
+            secure_pw = credentials.hash(form.password.data)
 
         new_user = User(
             name=form.name.data.title(),
@@ -218,35 +531,41 @@ def register():
         db.session.add(new_user)
         db.session.commit()
         login_user(new_user)
-        return redirect(url_for("home", user_id=current_user.id))
+        return redirect(url_for("main.home", user_id=current_user.id))
 
     return render_template("register.html", form=form, user_id=0)
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     """ Allows a user to login into their account """
     form = LoginForm()
 
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and check_password_hash(user.password, form.password.data):
+        with metrics.timer("password_hash_seconds", operation="check"):
+            valid = user is not None and credentials.verify(user.password, form.password.data)
+        if valid:
+            if credentials.needs_rehash(user.password):
+                with metrics.timer("password_hash_seconds", operation="rehash"):
+                    user.password = credentials.hash(form.password.data)
+                db.session.commit()
             login_user(user)
-            return redirect(url_for("home", user_id=current_user.id))
+            return redirect(url_for("main.home", user_id=current_user.id))
         flash("Incorrect credentials. Please try again.")
-        return redirect(url_for("login", user_id=0))
+        return redirect(url_for("main.login", user_id=0))
     return render_template("login.html", form=form, user_id=0)
 
 
-@app.route("/logout")
+@bp.route("/logout")
 @login_required
 def logout():
     """ Allows a user to logout of their account """
     logout_user()
-    return redirect(url_for("home"))
+    return redirect(url_for("main.home"))
 
 
-@app.route("/ingredient_library/<int:user_id>", methods=['GET', 'POST'])
+@bp.route("/ingredient_library/<int:user_id>", methods=['GET', 'POST'])
 @login_required
 @admin_only
 def ingredient_library(user_id):
@@ -255,72 +574,152 @@ def ingredient_library(user_id):
     data into the Trie
     """
     form = LibraryFileForm()
-    files = csv_handler.download_csv()
+    files = csv_handler.library_files()
 
     if form.validate_on_submit():
         file = form.file.data
         filename = secure_filename(file.filename)
         new_filename = f"{filename.split('.')[0]}_{date.today()}.csv"
-        file_path = os.path.join(app.config["UPLOAD_FOLDER"], new_filename)
-        file.save(file_path)
-
-        csv_handler.load_csv()
+        try:
+            csv_handler.import_library(file.stream, new_filename)
+        except ValueError as error:
+            db.session.rollback()
+            flash(str(error))
+            return redirect(url_for("main.ingredient_library", user_id=user_id))
+
+        with metrics.timer("ingredient_library_load_seconds"):
+            csv_handler.load_library()
+        seed_ingredients()
         flash("Upload Successful")
-        return redirect(url_for("ingredient_library", user_id=user_id, files=files))
+        return redirect(url_for("main.ingredient_library", user_id=user_id, files=files))
 
     return render_template("add_library.html", user_id=user_id, form=form, files=files)
 
 
-@app.route("/download_list/<int:user_id>")
+@bp.route("/download_list/<int:user_id>")
 @login_required
 @admin_only
 def list_downloads(user_id):
     """ Displays a list of previous uploaded csv files for administrators only """
-    files = csv_handler.download_csv()
+    files = csv_handler.library_files()
     return render_template("download.html", user_id=user_id, files=files)
 
 
-@app.route("/download_file/<int:user_id>/<filename>")
+@bp.route("/download_file/<int:user_id>/<filename>")
 @login_required
 @admin_only
 def download_file(user_id, filename):
-    """ Enables administrators to download past uploaded csv files """
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    """ Enables administrators to download past uploaded csv files, streamed from the database """
+    rows = csv_handler.download_csv(filename)
+    if rows is None:
+        abort(404)
+    return Response(stream_with_context(rows), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
 
 
-@app.route("/my_week/<int:user_id>")
+@bp.route("/my_week/<int:user_id>")
 @login_required
 @correct_user
+@cached_page(page_cache, "my_week")
 def my_week(user_id):
     """ Displays recipes that are planned for the current week """
-    user = User.query.get(user_id)
+    user = load_page_user(user_id, "my_week")
 
-    return render_template("my_week.html", user_id=user_id, user=user)
+    return render_template("my_week.html", user_id=user_id, user=user, has_recipes=has_recipes(user_id),
+                           form=PlanWeek())
 
 
-@app.route("/random_recipe/<int:user_id>")
+@bp.route("/random_recipe/<int:user_id>")
 @login_required
 @correct_user
 def random_recipe(user_id):
     """ Generates a random recipe for users based on their existing recipe database """
-    user = User.query.get(user_id)
+    user = load_page_user(user_id, "my_week")
 
-    rand = random.choice(user.recipes)
-    recipe = Recipes.query.get(rand.id)
-    return render_template("my_week.html", user_id=user_id, user=user, random=recipe)
+    recipe = Recipes.query.filter_by(user_id=user_id).order_by(db.func.random()).first()
+    return render_template("my_week.html", user_id=user_id, user=user, has_recipes=recipe is not None, random=recipe,
+                           form=PlanWeek())
 
 
-@app.route("/my_recipes/<int:user_id>")
+@bp.route("/plan_week/<int:user_id>", methods=["POST"])
 @login_required
 @correct_user
+def plan_week(user_id):
+    """
+    Fills every day of the week with one of the user's recipes, replacing the current schedule. Recipes scheduled
+    this week or planned in recent weeks are avoided, and ?quota=<category id>:<days> caps a category. Only a form
+    posted with the user's CSRF token can change the schedule
+    """
+    if not PlanWeek().validate_on_submit():
+        abort(400)
+
+    load_pantry_index(user_id)
+    ingredients, pantry = pantry_matcher.ingredient_sets(user_id)
+
+    categories, recent = {}, set()
+    for recipe_id, category_id, my_week_id in db.session.execute(
+            db.select(Recipes.id, Recipes.category_id, Recipes.my_week_id).where(Recipes.user_id == user_id)):
+        categories[recipe_id] = category_id
+        if my_week_id is not None:
+            recent.add(recipe_id)
+    since = date.today() - timedelta(weeks=meal_planner.recent_weeks)
+    recent.update(db.session.scalars(db.select(PlannedMeal.recipe_id)
+                                     .where(PlannedMeal.user_id == user_id, PlannedMeal.planned_on >= since)))
+    try:
+        quotas = {int(category): int(days) for category, days in
+                  (quota.split(":", 1) for quota in request.args.getlist("quota"))}
+    except ValueError:
+        abort(400)
+
+    days = db.session.execute(db.select(WeeklyMeal.id, WeeklyMeal.day_of_week)
+                              .where(WeeklyMeal.user_id == user_id).order_by(WeeklyMeal.id)).all()
+    plan = meal_planner.plan(len(days), categories, ingredients, pantry, recent, quotas,
+                             request.args.get("seed", type=int))
+
+    db.session.execute(db.update(Recipes).where(Recipes.user_id == user_id, Recipes.my_week_id.is_not(None))
+                       .values(my_week_id=None), execution_options={"synchronize_session": False})
+    scheduled = [(day, recipe_id) for day, recipe_id in zip(days, plan) if recipe_id is not None]
+    if scheduled:
+        db.session.execute(db.update(Recipes), [{"id": recipe_id, "my_week_id": day.id}
+                                                for day, recipe_id in scheduled])
+        db.session.execute(db.insert(PlannedMeal), [{"user_id": user_id, "recipe_id": recipe_id,
+                                                     "planned_on": date.today()} for _, recipe_id in scheduled])
+    touch_user_data(user_id)
+    db.session.commit()
+
+    if request.args.get("format") == "json":
+        return jsonify(plan=[{"day": day.day_of_week, "recipe_id": recipe_id} for day, recipe_id in zip(days, plan)])
+    return redirect(url_for("main.my_week", user_id=user_id))
+
+
+@bp.route("/my_recipes/<int:user_id>")
+@login_required
+@correct_user
+@cached_page(page_cache, "my_recipes")
 def my_recipes(user_id):
     """ Displays all categories and recipes associated with the user """
-    user = User.query.get(user_id)
+    user = load_page_user(user_id, "my_recipes")
 
     return render_template("my_recipes.html", user_id=current_user.id, user=user)
 
 
-@app.route("/create_category/<int:user_id>", methods=["GET", "POST"])
+@bp.route("/search_recipes/<int:user_id>")
+@login_required
+@correct_user
+def search_recipes(user_id):
+    """ Searches the names, ingredients and directions of the user's own recipes """
+    query = request.args.get("q", "")
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = 20
+    total, results = recipe_search.search(db.session, user_id, query, page, per_page)
+
+    if request.args.get("format") == "json":
+        return jsonify(total=total, page=page, results=[{"id": id, "name": name} for id, name in results])
+    return render_template("search_recipes.html", user_id=user_id, query=query, page=page, total=total,
+                           pages=-(-total // per_page), results=results)
+
+
+@bp.route("/create_category/<int:user_id>", methods=["GET", "POST"])
 @login_required
 @correct_user
 def create_category(user_id):
@@ -328,7 +727,7 @@ def create_category(user_id):
     form = CreateCategory()
 
     if form.cancel.data:
-        return redirect(url_for("my_recipes", user_id=user_id))
+        return redirect(url_for("main.my_recipes", user_id=user_id))
     if form.validate_on_submit():
         new_cat = Category(
             name=form.name.data.title(),
@@ -336,12 +735,13 @@ def create_category(user_id):
             user_id=user_id
         )
         db.session.add(new_cat)
+        touch_user_data(user_id)
         db.session.commit()
-        return redirect(url_for("my_recipes", user_id=user_id))
+        return redirect(url_for("main.my_recipes", user_id=user_id))
     return render_template("create_category.html", form=form, user_id=user_id)
 
 
-@app.route("/edit_category/<int:user_id>/<int:category_id>", methods=["GET", "POST"])
+@bp.route("/edit_category/<int:user_id>/<int:category_id>", methods=["GET", "POST"])
 @login_required
 @correct_user
 def edit_category(user_id, category_id):
@@ -354,38 +754,43 @@ def edit_category(user_id, category_id):
     )
     if form.validate_on_submit():
         if form.cancel.data:
-            return redirect(url_for("my_recipes", user_id=user_id))
+            return redirect(url_for("main.my_recipes", user_id=user_id))
 
         category_info.name = form.name.data.title()
         category_info.icon_img = form.icon_img.data
+        touch_user_data(user_id)
         db.session.commit()
-        return redirect(url_for("my_recipes", user_id=user_id))
+        return redirect(url_for("main.my_recipes", user_id=user_id))
 
     return render_template("create_category.html", form=form, user_id=user_id, category_id=category_id)
 
 
-@app.route("/delete_category/<int:user_id>/<int:category_id>")
+@bp.route("/delete_category/<int:user_id>/<int:category_id>")
 @login_required
 @correct_user
 def delete_category(user_id, category_id):
     """
     Enables users to delete categories they no longer desire. This will also delete all recipes under that category
     """
-    user = User.query.get(user_id)
+    user = user_cache.get(user_id)
 
+    deleted = []
     for recipe in user.recipes:
         if recipe.category_id == category_id:
+            deleted.append(recipe.id)
             db.session.delete(recipe)
     category = Category.query.get(category_id)
     db.session.delete(category)
+    recipe_search.remove(db.session, deleted)
+    touch_user_data(user_id)
     db.session.commit()
-    return redirect(url_for("my_recipes", user_id=user_id))
+    pantry_matcher.remove_recipes(user_id, deleted)
+    return redirect(url_for("main.my_recipes", user_id=user_id))
 
 
-@app.route("/create_recipe/<int:user_id>/<int:category_id>", methods=["GET", "POST"])
+@bp.route("/create_recipe/<int:user_id>/<int:category_id>", methods=["GET", "POST"])
 @login_required
 @correct_user
-@load_library
 def create_recipe(user_id, category_id):
     """
     Allows users to input various information for a recipe under the specified category.
@@ -395,7 +800,7 @@ def create_recipe(user_id, category_id):
     form = RecipesForm(recipe_type=category.name)
 
     if form.cancel.data:
-        return redirect(url_for("my_recipes", user_id=user_id))
+        return redirect(url_for("main.my_recipes", user_id=user_id))
     if form.validate_on_submit():
         ingredients_text = bleach_text.clean_text(form.ingredients.data)
         directions_text = bleach_text.clean_text(form.directions.data)
@@ -407,49 +812,36 @@ def create_recipe(user_id, category_id):
             link=form.link.data,
             ingredients=ingredients_text,
             directions=directions_text,
+            ingredients_hash=content_hash(form.ingredients.data),
+            directions_hash=content_hash(form.directions.data),
             user_id=user_id,
             category_id=category_id
         )
         db.session.add(new_recipe)
-
-        text = form.ingredients.data
-        omit = ["<ul>", "</ul>", "<li>", "</li>", "&nbsp", "frac12", "frac13", "frac14", "&ldquo", "&rdquo", ";", ", ",
-                " (", ")", "&", "\r\n\t", "\r\n", "grated ", "sliced ", "skinless ", "cooked ", "kosher ", "jar ",
-                "cup"]
-        for char in omit:
-            text = text.replace(char, "-*-")
-
-        for ingrdnt in text.title().split("-*-"):
-            if trie.search(ingrdnt):
-                db_ingredient = Ingredients.query.filter_by(name=ingrdnt, user_id=user_id).first()
-                db_cur_ingredient = CurrentIngredients.query.filter_by(name=ingrdnt, user_id=user_id).first()
-                if not db_ingredient:
-                    db_ingredient = Ingredients(
-                        name=ingrdnt,
-                        user_id=user_id
-                    )
-                    db.session.add(db_ingredient)
-                new_recipe.ingredient.append(db_ingredient)
-                if db_cur_ingredient:
-                    db_cur_ingredient.ingredient_id = db_ingredient.id
-                db.session.commit()
-
+        with metrics.timer("ingredient_extract_seconds"):
+            names = trie.extract(form.ingredients.data)
+        ingredient_ids, _ = link_ingredients(new_recipe, names)
+        db.session.flush()
+        recipe_search.index(db.session, new_recipe)
+        touch_user_data(user_id)
         db.session.commit()
-        return redirect(url_for("my_recipes", user_id=user_id))
+        pantry_matcher.set_recipe(user_id, new_recipe.id, new_recipe.name, ingredient_ids)
+        return redirect(url_for("main.my_recipes", user_id=user_id))
     return render_template("create_recipe.html", form=form, user_id=current_user.id, category_id=category_id)
 
 
-@app.route("/view_recipe/<int:user_id>/<recipe_id>", methods=["GET", "POST"])
+@bp.route("/view_recipe/<int:user_id>/<recipe_id>", methods=["GET", "POST"])
 @login_required
 @correct_user
+@cached_page(page_cache, "view_recipe")
 def view_recipe(user_id, recipe_id):
     """
     Allows users to view the information they have entered and also allow them to assign the recipe to a specified
     day of the week
     """
     form = AddToWeek()
-    user = User.query.get(user_id)
-    recipe = Recipes.query.get(recipe_id)
+    user = user_cache.get(user_id)
+    recipe = db.session.get(Recipes, recipe_id, options=PAGE_LOADS["view_recipe"])
 
     if form.validate_on_submit():
         if form.day.data and form.day.data != "Not Scheduled":
@@ -457,16 +849,16 @@ def view_recipe(user_id, recipe_id):
             recipe.my_week_id = day.id
         else:
             recipe.my_week_id = None
+        touch_user_data(user_id)
         db.session.commit()
 
-        return redirect(url_for("view_recipe", user_id=user_id, user=user, form=form, recipe_id=recipe_id))
+        return redirect(url_for("main.view_recipe", user_id=user_id, user=user, form=form, recipe_id=recipe_id))
     return render_template("view_recipe.html", user_id=user_id, user=user, form=form, recipe=recipe)
 
 
-@app.route("/edit_recipe/<int:user_id>", methods=["GET", "POST"])
+@bp.route("/edit_recipe/<int:user_id>", methods=["GET", "POST"])
 @login_required
 @correct_user
-@load_library
 def edit_recipe(user_id):
     """ Similar to adding a recipe, the user will be able to edit pre-existing information """
     recipe_id = request.args.get("recipe_id")
@@ -482,7 +874,7 @@ def edit_recipe(user_id):
     )
 
     if form.cancel.data:
-        return redirect(url_for("view_recipe", user_id=user_id, recipe_id=recipe_id))
+        return redirect(url_for("main.view_recipe", user_id=user_id, recipe_id=recipe_id))
     if form.validate_on_submit():
         category = Category.query.filter_by(name=form.recipe_type.data.title()).first()
         if not category:
@@ -491,42 +883,33 @@ def edit_recipe(user_id):
                 user_id=user_id
             )
             db.session.add(category)
-            db.session.commit()
-
-        ingredients_text = bleach_text.clean_text(form.ingredients.data)
-        directions_text = bleach_text.clean_text(form.directions.data)
-
-        text = form.ingredients.data.lower()
-        omit = ["<ul>", "</ul>", "<li>", "</li>", "&nbsp", "frac12", "frac13", "frac14", "&ldquo", "&rdquo", ";", ", ",
-                " (", ")", "&", "\r\n\t", "\r\n", "grated ", "sliced ", "skinless ", "cooked ", "kosher ", "jar ",
-                "cup"]
-        for char in omit:
-            text = text.replace(char, "-*-")
-
-        for ingrdnt in text.title().split("-*-"):
-            if trie.search(ingrdnt):
-                db_ingredient = Ingredients.query.filter_by(name=ingrdnt, user_id=user_id).first()
-                db_cur_ingredient = CurrentIngredients.query.filter_by(name=ingrdnt, user_id=user_id).first()
-                if not db_ingredient:
-                    db_ingredient = Ingredients(
-                        name=ingrdnt,
-                        user_id=user_id
-                    )
-                    db.session.add(db_ingredient)
-                recipe.ingredient.append(db_ingredient)
-                if db_cur_ingredient:
-                    db_cur_ingredient.ingredient_id = db_ingredient.id
-                db.session.commit()
+            db.session.flush()
+
+        # Only fields whose submitted text differs from the last save are sanitized again, and the ingredient links
+        # are reconciled only when the ingredient text changed
+        ingredient_ids, removed = {}, set()
+        ingredients_hash = content_hash(form.ingredients.data)
+        if ingredients_hash != recipe.ingredients_hash:
+            recipe.ingredients = bleach_text.clean_text(form.ingredients.data)
+            recipe.ingredients_hash = ingredients_hash
+            with metrics.timer("ingredient_extract_seconds"):
+                names = trie.extract(form.ingredients.data)
+            ingredient_ids, removed = link_ingredients(recipe, names)
+        directions_hash = content_hash(form.directions.data)
+        if directions_hash != recipe.directions_hash:
+            recipe.directions = bleach_text.clean_text(form.directions.data)
+            recipe.directions_hash = directions_hash
 
         recipe.name = form.name.data
         recipe.recipe_type = form.recipe_type.data
         recipe.img = form.img.data
         recipe.link = form.link.data
-        recipe.ingredients = ingredients_text
-        recipe.directions = directions_text
         recipe.category_id = category.id
+        recipe_search.index(db.session, recipe)
+        touch_user_data(user_id)
         db.session.commit()
-        return redirect(url_for("view_recipe", user_id=user_id, recipe_id=recipe_id))
+        pantry_matcher.set_recipe(user_id, recipe.id, recipe.name, ingredient_ids, removed)
+        return redirect(url_for("main.view_recipe", user_id=user_id, recipe_id=recipe_id))
     return render_template("create_recipe.html",
                            user_id=user_id,
                            form=form,
@@ -535,28 +918,32 @@ def edit_recipe(user_id):
                            edit=True)
 
 
-@app.route("/delete_recipe/<int:user_id>/<int:recipe_id>")
+@bp.route("/delete_recipe/<int:user_id>/<int:recipe_id>")
 @login_required
 @correct_user
 def delete_recipe(user_id, recipe_id):
     """ Enables users to delete the specified recipe from the database """
     recipe = Recipes.query.get(recipe_id)
     db.session.delete(recipe)
+    recipe_search.remove(db.session, [recipe_id])
+    touch_user_data(user_id)
     db.session.commit()
-    return redirect(url_for("my_recipes", user_id=user_id))
+    pantry_matcher.remove_recipes(user_id, [recipe_id])
+    return redirect(url_for("main.my_recipes", user_id=user_id))
 
 
-@app.route("/my_ingredients/<int:user_id>")
+@bp.route("/my_ingredients/<int:user_id>")
 @login_required
 @correct_user
+@cached_page(page_cache, "my_ingredients")
 def my_ingredients(user_id):
     """ Displays a list of ingredients that the user currently possess """
-    user = User.query.get(user_id)
+    user = load_page_user(user_id, "my_ingredients")
 
     return render_template("my_ingredients.html", user_id=user_id, user=user)
 
 
-@app.route("/add_ingredient/<int:user_id>", methods=['GET', "POST"])
+@bp.route("/add_ingredient/<int:user_id>", methods=['GET', "POST"])
 @login_required
 @correct_user
 def add_ingredient(user_id):
@@ -568,59 +955,113 @@ def add_ingredient(user_id):
     form_upload = LibraryFileForm()
 
     if form_add.cancel.data:
-        return redirect(url_for("my_ingredients", user_id=user_id))
+        return redirect(url_for("main.my_ingredients", user_id=user_id))
     if form_add.validate_on_submit():
-        related_ingrdt = Ingredients.query.filter_by(name=form_add.name.data.title()).first()
-        if not related_ingrdt:
-            new_ingredient = CurrentIngredients(
-                name=form_add.name.data.title(),
-                user_id=user_id,
-                ingredient=related_ingrdt.id if related_ingrdt else None
-            )
-            db.session.add(new_ingredient)
-            db.session.commit()
+        name = form_add.name.data.strip().title()
+        name = trie.lookup(name) or name
+        touch_user_data(user_id)
+        added, _ = import_current_ingredients([[name]], user_id)
+        pantry_matcher.update_pantry(user_id, added=added)
         flash("Added to List Successfully")
-        return redirect(url_for("my_ingredients", user_id=user_id))
+        return redirect(url_for("main.my_ingredients", user_id=user_id))
 
     if form_upload.validate_on_submit():
-        file = form_upload.file.data
-        filename = secure_filename(file.filename)
-        new_filename = f"{filename.split('.')[0]}_{user_id}"
-        file_path = os.path.join("static/user_files", new_filename)
-        file.save(file_path)
-
-        user_set = csv_handler.process_csv(new_filename)
-        for row in user_set:
-            query = Ingredients.query.filter_by(name=row, user_id=user_id).first()
-            current_ingredient = CurrentIngredients.query.filter_by(name=row, user_id=user_id).first()
-            if current_ingredient and query:
-                current_ingredient.ingredient_id = query.id
-            if not current_ingredient:
-                new_ingredient = CurrentIngredients(
-                    name=row,
-                    user_id=user_id,
-                    ingredient_id=query.id if query else None
-                )
-                db.session.add(new_ingredient)
-        db.session.commit()
-        flash("Upload Successful")
-        return redirect(url_for("my_ingredients", user_id=user_id))
+        touch_user_data(user_id)
+        try:
+            added, existing = import_current_ingredients(
+                csv_handler.read_ingredients(form_upload.file.data.stream), user_id
+            )
+        except ValueError as error:
+            db.session.rollback()
+            flash(str(error))
+            return redirect(url_for("main.add_ingredient", user_id=user_id))
+        pantry_matcher.update_pantry(user_id, added=added)
+        flash(f"Upload Successful: {len(added)} added, {existing} already listed")
+        return redirect(url_for("main.my_ingredients", user_id=user_id))
 
     return render_template("add_ingredient.html", user_id=user_id, form_add=form_add, form_upload=form_upload)
 
 
-@app.route("/delete_ingredient/<int:user_id>/<int:ingredient_id>")
+@bp.route("/delete_ingredient/<int:user_id>/<int:ingredient_id>")
 @login_required
 @correct_user
 def delete_ingredient(user_id, ingredient_id):
     """ Deletes the desired ingredient from the user's current ingredient database """
     ingredient = CurrentIngredients.query.get(ingredient_id)
+    removed = ingredient.ingredient_id
     db.session.delete(ingredient)
+    touch_user_data(user_id)
     db.session.commit()
-    return redirect(url_for("my_ingredients", user_id=user_id))
+    pantry_matcher.update_pantry(user_id, removed=[removed])
+    return redirect(url_for("main.my_ingredients", user_id=user_id))
+
+
+@bp.route("/cook_now/<int:user_id>")
+@login_required
+@correct_user
+def cook_now(user_id):
+    """ Ranks the user's recipes by how much of each one their current ingredients cover """
+    load_pantry_index(user_id)
+    matches = pantry_matcher.rank(user_id, request.args.get("limit", 50, type=int))
+
+    if request.args.get("format") == "json":
+        return jsonify(matches=matches)
+    return render_template("cook_now.html", user_id=user_id, matches=matches)
+
+
+@bp.route("/shopping_list/<int:user_id>")
+@login_required
+@correct_user
+def shopping_list(user_id):
+    """ Lists the ingredients to buy for the recipes scheduled this week, as a page, JSON or a streamed download """
+    query = shopping_list_query(user_id)
+    export = request.args.get("format")
+
+    if export in ("csv", "txt"):
+        def generate():
+            rows = db.session.execute(query.execution_options(yield_per=500))
+            if export == "txt":
+                for name, recipes in rows:
+                    yield f"{name} ({recipes})\n"
+                return
+
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(["Ingredient", "Recipes"])
+            for row in rows:
+                writer.writerow(row)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+
+        mimetype = "text/csv" if export == "csv" else "text/plain"
+        return Response(stream_with_context(generate()), mimetype=mimetype,
+                        headers={"Content-Disposition": f"attachment; filename=shopping_list.{export}"})
+
+    items = [{"name": name, "recipes": recipes} for name, recipes in db.session.execute(query)]
+    if export == "json":
+        return jsonify(items=items)
+    return render_template("shopping_list.html", user_id=user_id, items=items)
+
+
+@bp.route("/autocomplete/<int:user_id>")
+@login_required
+@correct_user
+def ingredient_autocomplete(user_id):
+    """ Returns the top ranked ingredient names starting with the typed prefix for the autocomplete fields """
+    if not autocomplete.library_loaded(csv_handler.version):
+        autocomplete.load_library(csv_handler.version, ingredient_counts())
+    version = user_cache.get(user_id).data_version
+    if not autocomplete.loaded(user_id, version):
+        autocomplete.load_user(user_id, version, ingredient_counts(user_id))
+
+    prefix = request.args.get("q", "")
+    suggestions = autocomplete.suggest(prefix, user_id, request.args.get("limit", type=int))
+    return jsonify(prefix=prefix, suggestions=suggestions)
 
 
-@app.route("/search/<int:user_id>", methods=['GET', 'POST'])
+@bp.route("/search/<int:user_id>", methods=['GET', 'POST'])
 @login_required
 @correct_user
 def search(user_id):
@@ -628,13 +1069,19 @@ def search(user_id):
     form = SearchRecipe()
 
     if form.validate_on_submit():
-        response = library.search_recipe_id(form.recipe.data)
-
-        return render_template("search.html", user_id=user_id, form=form, results=response["results"])
+        try:
+            results = library.search_recipe_id(form.recipe.data).get("results", [])
+            details = library.get_recipes(item["id"] for item in results[:current_app.config["SEARCH_DETAILS"]])
+        except requests.RequestException as error:
+            metrics.inc("recipe_api_errors", error=type(error).__name__)
+            flash("Recipe search is unavailable right now. Please try again shortly.")
+            return render_template("search.html", user_id=user_id, form=form)
+
+        return render_template("search.html", user_id=user_id, form=form, results=results, details=details)
     return render_template("search.html", user_id=user_id, form=form)
 
 
-@app.route("/search_id/<int:user_id>/<int:search_id>", methods=['GET', 'POST'])
+@bp.route("/search_id/<int:user_id>/<int:search_id>", methods=['GET', 'POST'])
 @login_required
 @correct_user
 def get_recipe_info(user_id, search_id):
@@ -642,16 +1089,88 @@ def get_recipe_info(user_id, search_id):
     Retrieves the associated recipe ID from the search function to display all relevant information for the requested
     recipe
     """
-    result = library.get_recipe(search_id)
+    try:
+        result = library.get_recipe(search_id)
+    except requests.RequestException as error:
+        metrics.inc("recipe_api_errors", error=type(error).__name__)
+        abort(503)
 
     return render_template("recipe_information.html", user_id=user_id, search_id=search_id, result=result)
 
 
-@app.context_processor
+@bp.route("/metrics/<int:user_id>")
+@login_required
+@admin_only
+def show_metrics(user_id):
+    """ Exposes the collected request, SQL, API and Trie timings in the Prometheus text format for administrators """
+    gauges = [("recipe_api_cache_events", {"event": event}, count) for event, count in library.cache_stats().items()]
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+
+@bp.app_errorhandler(CredentialsBusy)
+def credentials_busy(error):
+    """ Asks the client to retry when too many passwords are already waiting to be hashed """
+    metrics.inc("password_hash_rejected")
+    return Response(str(error), 503, {"Retry-After": "1"}, mimetype="text/plain")
+
+
+@bp.app_context_processor
 def inj_copyright():
     """ Displays the current year for the copyright notice """
     return {"year": date.today().year}
 
 
+def create_app(config=None):
+    """
+    Builds an application with its own set of extensions, without touching the database or the ingredient library.
+    The schema is created with `flask --app main init-db` and the Trie is loaded on the first request, or up front
+    when PRELOAD_LIBRARY is set, which under `gunicorn --preload wsgi:app` lets the workers share the master's copy
+    """
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
+    app.config["UPLOAD_FOLDER"] = os.environ.get("UPLOAD_FOLDER", "static/files")
+    app.config["SPOONACULAR_URL"] = os.environ.get("SPOONACULAR_URL", "https://api.spoonacular.com")
+    app.config["SPOON_API"] = os.environ.get("SPOON_API")
+    app.config["TRIE_SNAPSHOT"] = os.environ.get("TRIE_SNAPSHOT",
+                                                 os.path.join(app.instance_path, "ingredient_trie.bin"))
+    app.config["PRELOAD_LIBRARY"] = bool(os.environ.get("PRELOAD_LIBRARY"))
+    app.config["LIBRARY_CHECK_INTERVAL"] = 5
+    app.config["LIBRARY_BATCH_SIZE"] = 5000
+    app.config["PANTRY_INDEX_SIZE"] = 256
+    app.config["AUTOCOMPLETE_USERS"] = 256
+    app.config["AUTOCOMPLETE_COUNTS_TTL"] = 300
+    app.config["INGREDIENT_MAX_EDITS"] = 2
+    app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:260000")
+    app.config["USER_CACHE_TTL"] = int(os.environ.get("USER_CACHE_TTL", 0))
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", 1))
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///meals.db")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SEARCH_DETAILS"] = 12
+    app.config["METRICS_SLOW_REQUEST"] = float(os.environ["SLOW_REQUEST"]) if os.environ.get("SLOW_REQUEST") else None
+    app.config["METRICS_DIR"] = os.environ.get("METRICS_DIR")
+    os.makedirs(app.instance_path, exist_ok=True)
+    app.config["RECIPE_CACHE_URL"] = os.environ.get(
+        "RECIPE_CACHE_URL", f"sqlite:///{os.path.join(app.instance_path, 'recipe_cache.db')}"
+    )
+    app.config.update(config or {})
+
+    extensions = app.extensions["meal_planner"] = build_extensions()
+    for extension in [db, *extensions.values(), login_manager, bootstrap, ckeditor]:
+        extension.init_app(app)
+    with app.app_context():
+        metrics.instrument_session(library.session, "spoonacular")
+        metrics.instrument_engine(library.cache.engine, "recipe_cache")
+        metrics.instrument_engine(db.engine)
+    app.register_blueprint(bp)
+
+    if app.config["PRELOAD_LIBRARY"]:
+        with app.app_context():
+            refresh_library()
+            # Forked workers must open their own connections rather than share the one the master just used
+            db.engine.dispose()
+    return app
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
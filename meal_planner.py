@@ -0,0 +1,108 @@
+import random
+import time
+from collections import Counter
+
+
+class MealPlanner:
+    """
+    The object fills the days of the week with one recipe each. Plans favour recipes whose ingredients are already in
+    the pantry, recipes that share ingredients with the rest of the week and recipes not planned recently, while
+    keeping every category under its quota. A greedy pass builds the plan and a seeded local search improves it until
+    the time budget or iteration limit runs out, so the same seed gives the same plan
+    """
+
+    WEIGHTS = {"pantry": 1.0, "reuse": 0.5, "recent": 2.0}
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.weights = {**self.WEIGHTS, **app.config.get("MEAL_PLAN_WEIGHTS", {})}
+        self.category_max = app.config.get("MEAL_PLAN_CATEGORY_MAX", 3)
+        self.recent_weeks = app.config.get("MEAL_PLAN_RECENT_WEEKS", 2)
+        self.budget = app.config.get("MEAL_PLAN_BUDGET", 0.2)
+        self.iterations = app.config.get("MEAL_PLAN_ITERATIONS", 5000)
+        self.sample = app.config.get("MEAL_PLAN_SAMPLE", 32)
+        self.patience = app.config.get("MEAL_PLAN_PATIENCE", 300)
+
+    def plan(self, days, categories, ingredients, pantry, recent=(), quotas=None, seed=None):
+        """
+        Returns a recipe id for each of the given number of days, or None where no recipe fits. Recipes are given as
+        {recipe id: category id} and {recipe id: ingredient ids}, the pantry as a set of ingredient ids, and quotas as
+        {category id: most days}, falling back to the configured maximum for other categories
+        """
+        rng = random.Random(seed)
+        quotas = quotas or {}
+        recent = set(recent)
+        candidates = sorted(categories)
+        if not candidates or not days:
+            return [None] * days
+
+        reuse = self.weights["reuse"] / days
+        base = {}
+        for recipe_id in candidates:
+            recipe_ingredients = ingredients.get(recipe_id, ())
+            coverage = len(pantry.intersection(recipe_ingredients)) / len(recipe_ingredients) \
+                if recipe_ingredients else 0
+            base[recipe_id] = self.weights["pantry"] * coverage - self.weights["recent"] * (recipe_id in recent)
+
+        def fits(recipe_id, used_categories):
+            category = categories[recipe_id]
+            return used_categories[category] < quotas.get(category, self.category_max)
+
+        # Greedy construction: each day takes the recipe adding the most to the score, random keys breaking ties
+        plan, used, used_categories = [], Counter(), Counter()
+        chosen = set()
+        for _ in range(days):
+            best, best_key = None, None
+            for recipe_id in candidates:
+                if recipe_id in chosen or not fits(recipe_id, used_categories):
+                    continue
+                shared = sum(1 for ingredient_id in ingredients.get(recipe_id, ()) if used[ingredient_id])
+                key = (base[recipe_id] + reuse * shared, rng.random())
+                if best_key is None or key > best_key:
+                    best, best_key = recipe_id, key
+            plan.append(best)
+            if best is not None:
+                chosen.add(best)
+                used.update(ingredients.get(best, ()))
+                used_categories[categories[best]] += 1
+
+        # Local search: swap one day's recipe for a sampled unused one whenever that raises the score, stopping once
+        # a run of attempts brings no improvement
+        deadline = time.perf_counter() + self.budget
+        stale = 0
+        for _ in range(self.iterations):
+            if stale >= self.patience or time.perf_counter() > deadline:
+                break
+            stale += 1
+            day = rng.randrange(days)
+            current = plan[day]
+            current_ingredients = ingredients.get(current, ()) if current is not None else ()
+            if current is not None:
+                used_categories[categories[current]] -= 1
+            used.subtract(current_ingredients)
+            removed = sum(1 for ingredient_id in current_ingredients if used[ingredient_id])
+            current_score = (base[current] + reuse * removed) if current is not None else float("-inf")
+
+            best, best_score = current, current_score
+            for recipe_id in rng.sample(candidates, min(self.sample, len(candidates))):
+                if recipe_id in chosen or not fits(recipe_id, used_categories):
+                    continue
+                shared = sum(1 for ingredient_id in ingredients.get(recipe_id, ()) if used[ingredient_id])
+                score = base[recipe_id] + reuse * shared
+                if score > best_score:
+                    best, best_score = recipe_id, score
+
+            if best != current:
+                stale = 0
+                chosen.discard(current)
+                chosen.add(best)
+                plan[day] = best
+            if best is not None:
+                used_categories[categories[best]] += 1
+                used.update(ingredients.get(best, ()))
+        return plan
@@ -0,0 +1,242 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# Upper bounds in seconds shared by the latency histograms, plus one for per-request statement counts
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """ Cumulative-bucket histogram in the Prometheus layout """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    The object records request latency, SQL statements, outbound HTTP calls, template renders and any block timed
+    with timer(), and renders them in the Prometheus text format. Each observation is a clock read and a bisect
+    under a lock, cheap enough to leave on in production. Requests slower than METRICS_SLOW_REQUEST seconds are
+    logged with the statements they ran.
+
+    Observations are kept per process. With METRICS_DIR set, every process also writes its totals to a file of its
+    own there every METRICS_FLUSH_INTERVAL seconds and render() adds up all the files, so a scrape served by any
+    gunicorn worker reports the whole server. Files of exited workers are kept so counters never go backwards
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.slow_request = None
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.directory = None
+        self.flush_interval = 5
+        self.pid = None
+        self.path = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.slow_request = app.config.get("METRICS_SLOW_REQUEST")
+        self.directory = app.config.get("METRICS_DIR")
+        self.flush_interval = app.config.get("METRICS_FLUSH_INTERVAL", self.flush_interval)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        self.instrument_templates(app.jinja_env)
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _start_request(self):
+        if self.directory and self.pid != os.getpid():
+            self._start_process()
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = []
+
+    def _end_request(self, response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        queries = g.pop("metrics_queries", [])
+        endpoint = request.endpoint or "unmatched"
+
+        self.observe("http_request_duration_seconds", elapsed, endpoint=endpoint, method=request.method,
+                     status=str(response.status_code))
+        self.observe("http_request_sql_statements", len(queries), COUNT_BUCKETS, endpoint=endpoint)
+        if self.slow_request is not None and elapsed >= self.slow_request:
+            self.app.logger.warning(
+                "Slow request %s %s took %.3fs with %d statements (%.3fs in SQL):\n%s",
+                request.method, request.full_path.rstrip("?"), elapsed, len(queries), sum(t for _, t in queries),
+                "\n".join(f"  {t * 1000:.1f}ms {' '.join(statement.split())[:200]}" for statement, t in queries)
+            )
+        return response
+
+    def instrument_engine(self, engine, name="app"):
+        """ Times every statement the engine runs and attributes it to the current request """
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["metrics_start"].pop()
+            self.observe("sql_statement_duration_seconds", elapsed, database=name)
+            if has_request_context() and "metrics_queries" in g:
+                g.metrics_queries.append((statement, elapsed))
+
+    def instrument_session(self, session, service):
+        """ Records the latency and status of every response a requests session receives """
+        def record(response, *args, **kwargs):
+            self.observe("http_client_duration_seconds", response.elapsed.total_seconds(), service=service,
+                         status=str(response.status_code))
+        session.hooks["response"].append(record)
+
+    def instrument_templates(self, jinja_env):
+        """ Times top-level template renders, labelled by template name """
+        metrics = self
+
+        class TimedTemplate(jinja_env.template_class):
+            def render(self, *args, **kwargs):
+                with metrics.timer("template_render_seconds", template=self.name or "string"):
+                    return super().render(*args, **kwargs)
+
+        jinja_env.template_class = TimedTemplate
+
+    def _start_process(self):
+        """
+        Gives each process its own file, named with a random suffix so a reused pid never overwrites an exited
+        worker's totals, and a thread writing to it. Observations inherited from a preloading master belong to the
+        master and are dropped
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.path = os.path.join(self.directory, f"{self.pid}-{uuid.uuid4().hex[:8]}.metrics")
+            self.histograms.clear()
+            self.counters.clear()
+        threading.Thread(target=self._flush_forever, name="metrics-flush", daemon=True).start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _snapshot(self):
+        with self.lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()}
+            return histograms, dict(self.counters)
+
+    def flush(self):
+        """ Writes this process's totals to its file, replacing the previous ones atomically """
+        if self.path is None:
+            return
+        temp = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as file:
+            pickle.dump(self._snapshot(), file)
+        os.replace(temp, self.path)
+
+    def _collect(self):
+        """ Returns this process's totals, or the sum of every process's file when METRICS_DIR is set """
+        if not self.directory:
+            return self._snapshot()
+
+        self.flush()
+        histograms, counters = {}, {}
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".metrics"):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), "rb") as file:
+                    process_histograms, process_counters = pickle.load(file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+            for key, (buckets, counts, total, count) in process_histograms.items():
+                merged = histograms.get(key)
+                if merged is None:
+                    histograms[key] = (buckets, list(counts), total, count)
+                else:
+                    histograms[key] = (buckets, [a + b for a, b in zip(merged[1], counts)], merged[2] + total,
+                                       merged[3] + count)
+            for key, value in process_counters.items():
+                counters[key] = counters.get(key, 0) + value
+        return histograms, counters
+
+    def render(self, gauges=()):
+        """ Returns every metric in the Prometheus text format, followed by the given (name, labels, value) gauges """
+        collected, counters = self._collect()
+        histograms = [(key, counts, total, count, buckets)
+                      for key, (buckets, counts, total, count) in collected.items()]
+        counters = list(counters.items())
+
+        lines, typed = [], set()
+        for (name, labels), counts, total, count, buckets in sorted(histograms):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for (name, labels), value in sorted(counters):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name}_total counter")
+            lines.append(f"{name}_total{_labels(labels)} {value}")
+        for name, labels, value in gauges:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
@@ -0,0 +1,176 @@
+import sqlalchemy as sa
+from ingredient_trie import normalize
+
+# Indexes the models declare, so databases created before they existed can be brought up to date
+INDEXES = [
+    ("ix_ingredients_key", "ingredients", ["key"], True),
+    ("ix_current_ingredients_user_ingredient", "current_ingredients", ["user_id", "ingredient_id"], True),
+    ("ix_weekly_meal_user_day", "weekly_meal", ["user_id", "day_of_week"], True),
+    ("ix_recipes_user_id", "recipes", ["user_id"], False),
+    ("ix_recipes_category_id", "recipes", ["category_id"], False),
+    ("ix_recipes_my_week_id", "recipes", ["my_week_id"], False),
+    ("ix_recipe_to_ingredient_ingredient_id", "recipe_to_ingredient", ["ingredient_id"], False),
+]
+
+# Nullable columns added to existing tables after they were first created
+COLUMNS = [
+    ("recipes", "ingredients_hash", "VARCHAR(64)"),
+    ("recipes", "directions_hash", "VARCHAR(64)"),
+    ("user", "data_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("user", "data_changed", "TIMESTAMP"),
+]
+
+
+def upgrade(engine):
+    """
+    Adds the lookup indexes, uniqueness constraints, recipe_to_ingredient primary key and newer columns to a database
+    created before the models declared them, and moves per-user ingredient rows into the shared ingredient
+    dictionary. Duplicate rows are merged into the oldest copy first. Every step checks the current schema, so
+    running it again does nothing
+    """
+    if "user_id" in {c["name"] for c in sa.inspect(engine).get_columns("ingredients")}:
+        with engine.begin() as connection:
+            _share_ingredients(connection)
+
+    inspector = sa.inspect(engine)
+    new_columns = [column for column in COLUMNS
+                   if column[1] not in {c["name"] for c in inspector.get_columns(column[0])}]
+    if new_columns:
+        with engine.begin() as connection:
+            quote = connection.dialect.identifier_preparer.quote
+            for table, column, type_ in new_columns:
+                connection.execute(sa.text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {type_}"))
+
+    existing = {index["name"] for table in {index[1] for index in INDEXES} for index in inspector.get_indexes(table)}
+    missing = [index for index in INDEXES if index[0] not in existing]
+    merge = any(unique for _, _, _, unique in missing)
+    rebuild = merge or not inspector.get_pk_constraint("recipe_to_ingredient")["constrained_columns"]
+    if not missing and not rebuild:
+        return
+
+    with engine.begin() as connection:
+        if rebuild:
+            _rebuild_recipe_to_ingredient(connection)
+        if merge:
+            _merge_duplicates(connection)
+        for name, table, columns, unique in INDEXES:
+            connection.execute(sa.text(
+                f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+            ))
+
+
+def _keep_ids(table, columns):
+    """ Selects each row's id alongside the id of the oldest row sharing its values for the unique columns """
+    join = " AND ".join(f"k.{column} = t.{column}" for column in columns)
+    return (f"SELECT t.id AS id, COALESCE(k.keep_id, t.id) AS keep_id FROM {table} AS t "
+            f"LEFT JOIN (SELECT {', '.join(columns)}, MIN(id) AS keep_id FROM {table} GROUP BY {', '.join(columns)}) "
+            f"AS k ON {join}")
+
+
+def _rebuild_recipe_to_ingredient(connection):
+    """ Recreates the association table with a composite primary key, keeping one link per recipe and ingredient """
+    connection.execute(sa.text(
+        "CREATE TABLE recipe_to_ingredient_new ("
+        "recipe_id INTEGER NOT NULL REFERENCES recipes (id), "
+        "ingredient_id INTEGER NOT NULL REFERENCES ingredients (id), "
+        "PRIMARY KEY (recipe_id, ingredient_id))"
+    ))
+    connection.execute(sa.text(
+        "INSERT INTO recipe_to_ingredient_new (recipe_id, ingredient_id) "
+        "SELECT DISTINCT r.recipe_id, m.keep_id FROM recipe_to_ingredient AS r "
+        f"JOIN ({_keep_ids('ingredients', ['key'])}) AS m ON m.id = r.ingredient_id "
+        "WHERE r.recipe_id IS NOT NULL"
+    ))
+    connection.execute(sa.text("DROP TABLE recipe_to_ingredient"))
+    connection.execute(sa.text("ALTER TABLE recipe_to_ingredient_new RENAME TO recipe_to_ingredient"))
+
+
+def _merge_duplicates(connection):
+    """ Points references at the oldest of each set of duplicate rows, then deletes the duplicates """
+    references = [
+        ("current_ingredients", "ingredient_id", "ingredients", ["key"]),
+        ("recipes", "my_week_id", "weekly_meal", ["user_id", "day_of_week"]),
+    ]
+    for table, column, target, columns in references:
+        connection.execute(sa.text(
+            f"UPDATE {table} SET {column} = (SELECT m.keep_id FROM ({_keep_ids(target, columns)}) AS m "
+            f"WHERE m.id = {table}.{column}) WHERE {column} IS NOT NULL"
+        ))
+
+    for table, columns in [("current_ingredients", "user_id, ingredient_id"), ("weekly_meal", "user_id, day_of_week")]:
+        connection.execute(sa.text(
+            f"DELETE FROM {table} WHERE user_id IS NOT NULL AND id NOT IN "
+            f"(SELECT MIN(id) FROM {table} WHERE user_id IS NOT NULL GROUP BY {columns})"
+        ))
+    connection.execute(sa.text(
+        "DELETE FROM ingredients WHERE id NOT IN (SELECT MIN(id) FROM ingredients GROUP BY key)"
+    ))
+
+
+def _share_ingredients(connection):
+    """
+    Replaces the per-user ingredient rows with one row per normalized name. Recipe links and pantry items are pointed
+    at the shared rows, keeping one of each where a user had several names for the same ingredient, and pantry items
+    stop storing their own name. Names are normalized in Python, so the new tables are filled from here
+    """
+    metadata = sa.MetaData()
+    sa.Table("user", metadata, sa.Column("id", sa.Integer, primary_key=True))
+    sa.Table("recipes", metadata, sa.Column("id", sa.Integer, primary_key=True))
+    ingredients = sa.Table(
+        "ingredients_new", metadata,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("key", sa.String(500), nullable=False),
+        sa.Column("name", sa.String(500), nullable=False),
+    )
+    links = sa.Table(
+        "recipe_to_ingredient_new", metadata,
+        sa.Column("recipe_id", sa.Integer, sa.ForeignKey("recipes.id"), primary_key=True),
+        sa.Column("ingredient_id", sa.Integer, sa.ForeignKey("ingredients_new.id"), primary_key=True),
+    )
+    pantry = sa.Table(
+        "current_ingredients_new", metadata,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("user_id", sa.Integer, sa.ForeignKey("user.id")),
+        sa.Column("ingredient_id", sa.Integer, sa.ForeignKey("ingredients_new.id"), nullable=False),
+    )
+    metadata.create_all(connection, tables=[ingredients, links, pantry])
+
+    # The oldest spelling of each ingredient becomes its name, recipe ingredients before pantry items
+    shared, old_ids = {}, {}
+    old_ingredients = connection.execute(sa.text("SELECT id, name FROM ingredients ORDER BY id")).all()
+    old_pantry = connection.execute(sa.text("SELECT id, user_id, name FROM current_ingredients ORDER BY id")).all()
+    for name in [row.name for row in old_ingredients] + [row.name for row in old_pantry]:
+        key = normalize(name or "")
+        if key and key not in shared:
+            shared[key] = (len(shared) + 1, name)
+    for row in old_ingredients:
+        key = normalize(row.name or "")
+        if key:
+            old_ids[row.id] = shared[key][0]
+
+    if shared:
+        connection.execute(ingredients.insert(), [{"id": id_, "key": key, "name": name}
+                                                  for key, (id_, name) in shared.items()])
+    new_links = {(row.recipe_id, old_ids[row.ingredient_id])
+                 for row in connection.execute(sa.text("SELECT recipe_id, ingredient_id FROM recipe_to_ingredient"))
+                 if row.recipe_id is not None and row.ingredient_id in old_ids}
+    if new_links:
+        connection.execute(links.insert(), [{"recipe_id": recipe_id, "ingredient_id": ingredient_id}
+                                            for recipe_id, ingredient_id in sorted(new_links)])
+    kept = {}
+    for row in old_pantry:
+        key = normalize(row.name or "")
+        if key:
+            kept.setdefault((row.user_id, shared[key][0]), row.id)
+    if kept:
+        connection.execute(pantry.insert(), [{"id": id_, "user_id": user_id, "ingredient_id": ingredient_id}
+                                             for (user_id, ingredient_id), id_ in kept.items()])
+
+    for table in ["recipe_to_ingredient", "current_ingredients", "ingredients"]:
+        connection.execute(sa.text(f"DROP TABLE {table}"))
+        connection.execute(sa.text(f"ALTER TABLE {table}_new RENAME TO {table}"))
+    if connection.dialect.name == "postgresql":
+        for table in ["ingredients", "current_ingredients"]:
+            connection.execute(sa.text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table}"
+            ))
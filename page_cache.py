@@ -0,0 +1,164 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, session, make_response
+from flask_login import current_user
+
+
+class MemoryBackend:
+    """ In-process LRU of rendered pages, private to each worker """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = time.time() + ttl, value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class FileSystemBackend:
+    """
+    Rendered pages stored as one file per key, shared by every worker on the host. Files are replaced atomically and
+    expired ones are removed every so often
+    """
+
+    def __init__(self, directory, prune_every=100):
+        self.directory = directory
+        self.prune_every = prune_every
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as file:
+                expires, value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value if expires >= time.time() else None
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, "wb") as file:
+            pickle.dump((time.time() + ttl, value), file)
+        os.replace(temp, path)
+
+        self.writes += 1
+        if self.writes % self.prune_every == 0:
+            self.prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def prune(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "rb") as file:
+                    expires, _ = pickle.load(file)
+                if expires < now:
+                    os.remove(path)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+
+
+class PageCache:
+    """
+    The object caches rendered pages per user, keyed by the user's data version, which every write route bumps.
+    Responses carry an ETag and Last-Modified so browsers revalidate, and a matching ETag is answered with a 304
+    before the page is queried or rendered. Keys also include the session's CSRF secret and a time bucket shorter
+    than the CSRF token lifetime, so cached forms never hold a stale token
+    """
+
+    def __init__(self, app=None, version_of=None):
+        self.app = None
+        self.version_of = version_of
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get("PAGE_CACHE_TTL", 30 * 60)
+        if app.config.get("PAGE_CACHE_BACKEND", "memory") == "filesystem":
+            self.backend = FileSystemBackend(app.config.get("PAGE_CACHE_DIR",
+                                                            os.path.join(app.instance_path, "page_cache")))
+        else:
+            self.backend = MemoryBackend(app.config.get("PAGE_CACHE_SIZE", 256))
+
+    def _key(self, page, version):
+        return "|".join([
+            str(current_user.id), page, str(version), request.full_path,
+            str(session.get("csrf_token", "")), str(int(time.time() // self.ttl)),
+        ])
+
+    def serve(self, page, view, *args, **kwargs):
+        """ Serves a GET request for the page from the cache, or a 304 when the browser copy is current """
+        version, changed = self.version_of(current_user)
+        etag = hashlib.sha1(self._key(page, version).encode("utf-8")).hexdigest()
+        if etag in request.if_none_match:
+            response = make_response("", 304)
+        else:
+            body = self.backend.get(etag)
+            if body is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                # Rendering may have created the CSRF secret, so the entry is stored under the final key
+                etag = hashlib.sha1(self._key(page, version).encode("utf-8")).hexdigest()
+                self.backend.set(etag, response.get_data(), self.ttl)
+            else:
+                response = make_response(body)
+
+        response.set_etag(etag)
+        if changed is not None:
+            response.last_modified = changed
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+
+def cached_page(cache, page):
+    """
+    Decorator serving GET requests for the page through the cache. The cache is only used once a request arrives, so
+    it can be a proxy to the current application's PageCache
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return f(*args, **kwargs)
+            return cache.serve(page, f, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,163 @@
+import threading
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+
+
+class UserIndex:
+    """
+    The object holds one user's recipe ingredients, the inverted ingredient index and their pantry, along with the
+    user's data_version it reflects. Its lock keeps a ranking from reading the sets while a write patches them
+    """
+
+    def __init__(self, version, recipe_names, links, pantry):
+        self.version = version
+        self.lock = threading.Lock()
+        self.recipe_names = dict(recipe_names)
+        self.recipe_ingredients = {recipe_id: set() for recipe_id in self.recipe_names}
+        self.recipes_by_ingredient = {}
+        self.ingredient_names = {}
+        self.pantry = set(pantry)
+
+        for recipe_id, ingredient_id, name in links:
+            self.link(recipe_id, ingredient_id, name)
+
+    def link(self, recipe_id, ingredient_id, name):
+        self.ingredient_names[ingredient_id] = name
+        self.recipe_ingredients.setdefault(recipe_id, set()).add(ingredient_id)
+        self.recipes_by_ingredient.setdefault(ingredient_id, set()).add(recipe_id)
+
+    def unlink(self, recipe_id, ingredient_id):
+        self.recipe_ingredients.get(recipe_id, set()).discard(ingredient_id)
+        self.recipes_by_ingredient.get(ingredient_id, set()).discard(recipe_id)
+
+    def remove(self, recipe_id):
+        for ingredient_id in self.recipe_ingredients.pop(recipe_id, ()):
+            self.recipes_by_ingredient[ingredient_id].discard(recipe_id)
+        self.recipe_names.pop(recipe_id, None)
+
+    def update_pantry(self, added=(), removed=()):
+        """ Pantry items are ingredient dictionary ids, the same ids the recipes link to """
+        self.pantry.difference_update(removed)
+        self.pantry.update(added)
+
+
+class PantryMatcher:
+    """
+    The object ranks a user's recipes by how many of their ingredients are in the user's pantry. Pantry items are
+    counted against an inverted index from ingredient to recipes, so only recipes sharing an ingredient with the
+    pantry are touched. Indexes are built on first use, kept for the PANTRY_INDEX_SIZE most recent users and patched
+    as recipes and pantry items change. Each index records the user's data_version, so one left behind by a write
+    served through another worker is rebuilt rather than used
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.size = 256
+        self.indexes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.size = app.config.get("PANTRY_INDEX_SIZE", self.size)
+
+    def _get(self, user_id):
+        with self.lock:
+            index = self.indexes.get(user_id)
+            if index is not None:
+                self.indexes.move_to_end(user_id)
+            return index
+
+    def loaded(self, user_id, version):
+        """ Whether the user has an index reflecting the given data_version """
+        index = self._get(user_id)
+        return index is not None and index.version == version
+
+    def load(self, user_id, version, recipe_names, links, pantry):
+        """ Builds the index from (recipe id, name) pairs, (recipe id, ingredient id, name) links and pantry ids """
+        index = UserIndex(version, recipe_names, links, pantry)
+        with self.lock:
+            self.indexes[user_id] = index
+            self.indexes.move_to_end(user_id)
+            while len(self.indexes) > self.size:
+                self.indexes.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.indexes.pop(user_id, None)
+
+    @contextmanager
+    def _patch(self, user_id):
+        """
+        Yields the user's index, locked, for a write to update, or None when there is none. Every write bumps
+        data_version once, so the index's version is advanced by one. If another worker wrote in between, the index
+        still trails the user's version and is rebuilt on its next use
+        """
+        index = self._get(user_id)
+        if index is None:
+            yield None
+            return
+        with index.lock:
+            index.version += 1
+            yield index
+
+    def set_recipe(self, user_id, recipe_id, name, ingredients=None, removed=()):
+        """ Records a saved recipe, adding the given {ingredient name: id} links and dropping the removed ids """
+        with self._patch(user_id) as index:
+            if index is None:
+                return
+            index.recipe_names[recipe_id] = name
+            index.recipe_ingredients.setdefault(recipe_id, set())
+            for ingredient_name, ingredient_id in (ingredients or {}).items():
+                index.link(recipe_id, ingredient_id, ingredient_name)
+            for ingredient_id in removed:
+                index.unlink(recipe_id, ingredient_id)
+
+    def remove_recipes(self, user_id, recipe_ids):
+        with self._patch(user_id) as index:
+            if index is not None:
+                for recipe_id in recipe_ids:
+                    index.remove(recipe_id)
+
+    def update_pantry(self, user_id, added=(), removed=()):
+        with self._patch(user_id) as index:
+            if index is not None:
+                index.update_pantry(added, removed)
+
+    def ingredient_sets(self, user_id):
+        """ Returns copies of the user's {recipe id: ingredient ids} and the set of ingredient ids in their pantry """
+        index = self.indexes[user_id]
+        with index.lock:
+            return {recipe_id: set(ids) for recipe_id, ids in index.recipe_ingredients.items()}, set(index.pantry)
+
+    def rank(self, user_id, limit=None):
+        """
+        Returns the user's recipes ordered by pantry coverage with the ingredients each one is missing. Recipes without
+        any recognized ingredients are left out
+        """
+        index = self.indexes[user_id]
+        with index.lock:
+            have = Counter()
+            for ingredient_id in index.pantry:
+                have.update(index.recipes_by_ingredient.get(ingredient_id, ()))
+
+            ranked = sorted(
+                (recipe_id for recipe_id, ingredients in index.recipe_ingredients.items() if ingredients),
+                key=lambda recipe_id: (
+                    -have[recipe_id] / len(index.recipe_ingredients[recipe_id]),
+                    len(index.recipe_ingredients[recipe_id]) - have[recipe_id],
+                    index.recipe_names[recipe_id],
+                )
+            )
+
+            results = []
+            for recipe_id in ranked[:limit]:
+                ingredients = index.recipe_ingredients[recipe_id]
+                results.append({
+                    "recipe_id": recipe_id,
+                    "name": index.recipe_names[recipe_id],
+                    "have": have[recipe_id],
+                    "total": len(ingredients),
+                    "coverage": have[recipe_id] / len(ingredients),
+                    "missing": sorted(index.ingredient_names[i] for i in ingredients - index.pantry),
+                })
+            return results
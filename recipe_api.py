@@ -1,25 +1,296 @@
+import json
+import time
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+class ResponseCache:
+    """
+    The object keeps API responses in two tiers: an in-process LRU in front of a table shared by every worker.
+    Entries are stored with the time they were fetched so each endpoint can apply its own freshness rules
+    """
+
+    def __init__(self, url, size=512, max_age=60 * 60 * 24 * 8, prune_every=100):
+        self.size = size
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.writes = 0
+
+        # The table is created on first use, so building the cache never opens a connection, not even in a
+        # preloading master process whose connections the forked workers would share
+        self.engine = sa.create_engine(url)
+        self.table = sa.Table(
+            "api_cache", sa.MetaData(),
+            sa.Column("key", sa.String, primary_key=True),
+            sa.Column("body", sa.Text, nullable=False),
+            sa.Column("fetched_at", sa.Float, nullable=False, index=True),
+        )
+        self.created = False
+
+    def _create_table(self):
+        if not self.created:
+            self.table.create(self.engine, checkfirst=True)
+            self.created = True
+
+    def get(self, key):
+        """ Returns (value, fetched_at) from the LRU or the shared table, or None if the key was never stored """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self.entries[key]
+
+        self._create_table()
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                sa.select(self.table.c.body, self.table.c.fetched_at).where(self.table.c.key == key)
+            ).first()
+        if row is None:
+            return None
+
+        self.stats["store_hits"] += 1
+        entry = json.loads(row.body), row.fetched_at
+        self._remember(key, entry)
+        return entry
+
+    def set(self, key, value, fetched_at):
+        """ Stores the value in both tiers, pruning rows older than max_age from the table every so often """
+        self._remember(key, (value, fetched_at))
+
+        values = {"key": key, "body": json.dumps(value), "fetched_at": fetched_at}
+        dialect = postgresql if self.engine.dialect.name == "postgresql" else sqlite
+        upsert = dialect.insert(self.table).values(**values)
+        upsert = upsert.on_conflict_do_update(index_elements=["key"], set_={
+            "body": upsert.excluded.body,
+            "fetched_at": upsert.excluded.fetched_at,
+        })
+
+        self._create_table()
+        with self.engine.begin() as connection:
+            connection.execute(upsert)
+            self.writes += 1
+            if self.writes % self.prune_every == 0:
+                connection.execute(self.table.delete().where(self.table.c.fetched_at < fetched_at - self.max_age))
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class CircuitOpenError(requests.RequestException):
+    """ Raised instead of calling the API while the circuit breaker is open """
+
+
+class CircuitBreaker:
+    """
+    The object stops calls to a failing API. After threshold consecutive failures the circuit opens and calls fail
+    immediately until reset_after seconds pass, then a single trial call decides whether it closes again
+    """
+
+    def __init__(self, threshold=5, reset_after=30):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_after:
+                raise CircuitOpenError("The recipe API is unavailable, try again shortly")
+            # Let this call through as the trial and hold everything else until it reports back
+            self.opened_at = time.monotonic()
+
+    def record(self, success):
+        with self.lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold:
+                    self.opened_at = time.monotonic()
 
 
 class RecipeLibrary:
     """ The object calls and retrieves data from a specified API """
 
-    def __init__(self, app, key):
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    # Seconds a response is fresh, then how much longer it may be served stale while it is refreshed
+    TTLS = {
+        "search": (60 * 60, 60 * 60 * 24),
+        "information": (60 * 60 * 24, 60 * 60 * 24 * 7),
+    }
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
         self.app = app
-        self.endpoint = "https://api.spoonacular.com"
-        self.key = key
+        self.endpoint = app.config.get("SPOONACULAR_URL", "https://api.spoonacular.com")
+        self.key = app.config.get("SPOON_API")
+        self.ttls = {**self.TTLS, **app.config.get("RECIPE_CACHE_TTLS", {})}
+        self.cache = ResponseCache(
+            app.config["RECIPE_CACHE_URL"],
+            app.config.get("RECIPE_CACHE_SIZE", 512),
+            max(ttl + stale for ttl, stale in self.ttls.values())
+        )
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+        self.timeout = app.config.get("RECIPE_API_TIMEOUT", (3.05, 10))
+        self.retries = app.config.get("RECIPE_API_RETRIES", 2)
+        self.backoff = app.config.get("RECIPE_API_BACKOFF", 0.3)
+        self.budget = app.config.get("RECIPE_API_BUDGET", 15)
+        self.breaker = CircuitBreaker(app.config.get("RECIPE_API_FAILURES", 5), app.config.get("RECIPE_API_RESET", 30))
+        self.workers = app.config.get("RECIPE_API_WORKERS", 8)
+        self.session = requests.Session()
+        self.session.mount(self.endpoint, HTTPAdapter(pool_connections=1, pool_maxsize=self.workers))
 
     def search_recipe_id(self, query):
         params = {
-            "apiKey": self.key,
             "query": query
         }
-        response = requests.get(url=f"{self.endpoint}/recipes/complexSearch", params=params)
-        return response.json()
+        return self._cached("search", "/recipes/complexSearch", params)
 
     def get_recipe(self, query):
-        params = {
-            "apiKey": self.key
-        }
-        response = requests.get(url=f"{self.endpoint}/recipes/{query}/information", params=params)
-        return response.json()
+        return self._cached("information", f"/recipes/{query}/information", {})
+
+    def get_recipes(self, ids):
+        """ Fetches the information for several recipes concurrently and returns it keyed by recipe ID """
+        ids = list(ids)
+        if not ids:
+            return {}
+
+        def fetch(recipe_id):
+            try:
+                return recipe_id, self.get_recipe(recipe_id)
+            except requests.RequestException:
+                return recipe_id, None
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(ids))) as executor:
+            return {recipe_id: info for recipe_id, info in executor.map(fetch, ids) if info is not None}
+
+    def cache_stats(self):
+        return dict(self.cache.stats)
+
+    def _cached(self, kind, path, params):
+        """
+        Serves fresh responses from the cache, serves stale ones while refreshing them in the background and only
+        waits on the API for a miss. Identical requests already in flight share the one upstream call, and an
+        expired response is returned if the API fails
+        """
+        key = f"{path}?{json.dumps(params, sort_keys=True)}"
+        ttl, stale = self.ttls[kind]
+        entry = self.cache.get(key)
+
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < ttl:
+                self.cache.stats["hits"] += 1
+                return value
+            if age < ttl + stale:
+                self.cache.stats["stale_hits"] += 1
+                # Only the first stale hit starts a refresh, the rest keep serving the stale response until it lands
+                with self.pending_lock:
+                    refresh = key not in self.pending
+                    if refresh:
+                        future = self.pending[key] = Future()
+                if refresh:
+                    threading.Thread(target=self._refresh, args=(key, path, params, future), daemon=True).start()
+                return value
+
+        self.cache.stats["misses"] += 1
+        try:
+            return self._fetch(key, path, params)
+        except requests.RequestException:
+            if entry is None:
+                raise
+            # An expired response is still better than an error page while the API is down
+            self.cache.stats["stale_errors"] += 1
+            return entry[0]
+
+    def _refresh(self, key, path, params, future):
+        try:
+            self._request(key, path, params, future)
+        except requests.RequestException as error:
+            self.app.logger.warning("Could not refresh %s: %s", path, error)
+
+    def _fetch(self, key, path, params):
+        with self.pending_lock:
+            future = self.pending.get(key)
+            leader = future is None
+            if leader:
+                future = self.pending[key] = Future()
+
+        if not leader:
+            self.cache.stats["coalesced"] += 1
+            return future.result()
+        return self._request(key, path, params, future)
+
+    def _request(self, key, path, params, future):
+        """ Calls the API for a key already claimed in pending, resolving its future for any requests waiting on it """
+        try:
+            self.breaker.before_call()
+            try:
+                response = self._get(path, params)
+            except requests.RequestException:
+                self.breaker.record(False)
+                raise
+            self.breaker.record(response.status_code < 500)
+            value = response.json()
+            if response.ok:
+                self.cache.set(key, value, time.time())
+            future.set_result(value)
+            return value
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self.pending_lock:
+                del self.pending[key]
+
+    def _get(self, path, params):
+        """
+        Calls the API, retrying failed connections, timeouts and overloaded responses with exponential backoff. All
+        attempts and waits share a budget of RECIPE_API_BUDGET seconds, and each attempt's timeouts are cut to what is
+        left of it, so a slow API holds a request for at most that long before the last error or response is returned
+        and the stale value or the circuit breaker takes over
+        """
+        deadline = time.monotonic() + self.budget
+        connect, read = self.timeout if isinstance(self.timeout, tuple) else (self.timeout, self.timeout)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            error = response = None
+            try:
+                response = self.session.get(url=f"{self.endpoint}{path}", params={"apiKey": self.key, **params},
+                                            timeout=(min(connect, remaining), min(read, remaining)))
+            except (requests.ConnectionError, requests.Timeout) as failure:
+                error = failure
+
+            wait = self.backoff * 2 ** attempt
+            retry = error is not None or response.status_code in self.RETRY_STATUSES
+            if not retry or attempt == self.retries or time.monotonic() + wait >= deadline:
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(wait)
+            attempt += 1
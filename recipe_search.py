@@ -0,0 +1,115 @@
+import re
+import sqlalchemy as sa
+from sqlalchemy.engine import make_url
+from ingredient_trie import plain_text
+
+SEARCH_TERM = re.compile(r"\w+")
+
+
+class RecipeSearch:
+    """
+    The object keeps a full-text index over each recipe's name, ingredients and directions. SQLite databases use an
+    FTS5 table ranked with bm25 and PostgreSQL databases use a weighted tsvector ranked with ts_rank. Names weigh the
+    most, then ingredients, then directions
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.dialect = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.dialect = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name()
+
+    def setup(self, engine):
+        """ Creates the index if it does not exist yet and fills it with the recipes already saved """
+        self.dialect = engine.dialect.name
+        inspector = sa.inspect(engine)
+        if "recipe_search" in inspector.get_table_names():
+            return
+
+        with engine.begin() as connection:
+            if self.dialect == "postgresql":
+                connection.execute(sa.text(
+                    "CREATE TABLE recipe_search ("
+                    "recipe_id INTEGER PRIMARY KEY REFERENCES recipes (id) ON DELETE CASCADE, "
+                    "user_id INTEGER NOT NULL, document TSVECTOR NOT NULL)"
+                ))
+                connection.execute(sa.text(
+                    "CREATE INDEX ix_recipe_search_document ON recipe_search USING GIN (document)"
+                ))
+                connection.execute(sa.text("CREATE INDEX ix_recipe_search_user_id ON recipe_search (user_id)"))
+            else:
+                # The owner column holds a u<user_id> token so the user filter is part of the full-text match
+                connection.execute(sa.text(
+                    "CREATE VIRTUAL TABLE recipe_search USING fts5("
+                    "owner, name, ingredients, directions, tokenize = 'porter unicode61')"
+                ))
+
+            recipes = connection.execute(sa.text(
+                "SELECT id, user_id, name, ingredients, directions FROM recipes WHERE user_id IS NOT NULL"
+            ))
+            for recipe in recipes:
+                self._upsert(connection, *recipe)
+
+    def index(self, session, recipe):
+        """ Adds or refreshes a recipe in the index within the caller's transaction """
+        self._upsert(session, recipe.id, recipe.user_id, recipe.name, recipe.ingredients, recipe.directions)
+
+    def remove(self, session, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if recipe_ids:
+            column = "recipe_id" if self.dialect == "postgresql" else "rowid"
+            session.execute(sa.text(f"DELETE FROM recipe_search WHERE {column} IN :ids")
+                            .bindparams(sa.bindparam("ids", expanding=True)), {"ids": recipe_ids})
+
+    def search(self, session, user_id, query, page=1, per_page=20):
+        """ Returns (total matches, [(recipe id, name)]) for one page of the user's recipes, best match first """
+        terms = SEARCH_TERM.findall(query)
+        if not terms:
+            return 0, []
+        params = {"user_id": user_id, "limit": per_page, "offset": (page - 1) * per_page}
+
+        if self.dialect == "postgresql":
+            params["query"] = " & ".join(f"{term}:*" for term in terms)
+            match = "FROM recipe_search AS s JOIN recipes AS r ON r.id = s.recipe_id " \
+                    "WHERE s.user_id = :user_id AND s.document @@ to_tsquery('english', :query)"
+            rank = "ts_rank(s.document, to_tsquery('english', :query)) DESC"
+        else:
+            # Terms are scoped to the text columns so a query like "u1" cannot match every recipe through the owner
+            terms = " AND ".join(f'"{term}" *' for term in terms)
+            params["query"] = f"owner : u{user_id} AND {{name ingredients directions}} : ({terms})"
+            match = "FROM recipe_search JOIN recipes AS r ON r.id = recipe_search.rowid " \
+                    "WHERE recipe_search MATCH :query"
+            rank = "bm25(recipe_search, 0.0, 10.0, 5.0, 1.0)"
+
+        total = session.execute(sa.text(f"SELECT COUNT(*) {match}"), params).scalar()
+        results = session.execute(
+            sa.text(f"SELECT r.id, r.name {match} ORDER BY {rank}, r.id LIMIT :limit OFFSET :offset"), params
+        ).all()
+        return total, results
+
+    def _upsert(self, connection, recipe_id, user_id, name, ingredients, directions):
+        values = {
+            "recipe_id": recipe_id,
+            "user_id": user_id,
+            "name": name,
+            "ingredients": plain_text(ingredients),
+            "directions": plain_text(directions),
+        }
+        if self.dialect == "postgresql":
+            connection.execute(sa.text(
+                "INSERT INTO recipe_search (recipe_id, user_id, document) VALUES (:recipe_id, :user_id, "
+                "setweight(to_tsvector('english', :name), 'A') || "
+                "setweight(to_tsvector('english', :ingredients), 'B') || "
+                "setweight(to_tsvector('english', :directions), 'C')) "
+                "ON CONFLICT (recipe_id) DO UPDATE SET user_id = excluded.user_id, document = excluded.document"
+            ), values)
+        else:
+            connection.execute(sa.text("DELETE FROM recipe_search WHERE rowid = :recipe_id"), values)
+            connection.execute(sa.text(
+                "INSERT INTO recipe_search (rowid, owner, name, ingredients, directions) "
+                "VALUES (:recipe_id, 'u' || :user_id, :name, :ingredients, :directions)"
+            ), values)
@@ -0,0 +1,171 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import posixpath
+import mimetypes
+from io import BytesIO
+from flask import request, send_from_directory
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt"}
+IMAGES = {".jpg", ".jpeg", ".png"}
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+# Encodings in order of preference with the suffix of their precompressed files
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def fingerprint(path, data):
+    """ Inserts a hash of the content before the extension, so the name changes whenever the file does """
+    stem, ext = posixpath.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def optimize_image(data, ext, max_width, quality):
+    """ Shrinks images wider than max_width and re-encodes them. Returns the image and a WebP copy """
+    image = Image.open(BytesIO(data))
+    if image.width > max_width:
+        image = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+        output = BytesIO()
+        if ext == ".png":
+            image.save(output, "PNG", optimize=True)
+        else:
+            image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+        data = output.getvalue()
+
+    webp = BytesIO()
+    image.save(webp, "WEBP", quality=quality, method=6)
+    return data, webp.getvalue()
+
+
+def compress(data):
+    """ Returns the precompressed copies of the data keyed by file suffix, keeping only those that are smaller """
+    copies = {".gz": gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        copies[".br"] = brotli.compress(data, quality=11)
+    return {suffix: copy for suffix, copy in copies.items() if len(copy) < len(data)}
+
+
+def build(static_folder, directories=("css", "images"), max_width=1920, quality=80):
+    """
+    Copies the assets under the given static directories into static/dist with fingerprinted names and writes the
+    manifest mapping each original path to its copy. Images are capped at max_width and given WebP copies when
+    Pillow is installed, stylesheets have their url() references pointed at the fingerprinted images and text files
+    get gzip copies, plus brotli ones when Brotli is installed. Earlier builds are left in place, so pages rendered
+    before a deploy can still load their assets
+    """
+    output = os.path.join(static_folder, "dist")
+    sources = []
+    for directory in directories:
+        for root, _, files in os.walk(os.path.join(static_folder, directory)):
+            for name in files:
+                sources.append(os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, "/"))
+    # Stylesheets come last so the images they reference already have their fingerprinted names
+    sources.sort(key=lambda path: (posixpath.splitext(path)[1] == ".css", path))
+
+    assets, variants = {}, {}
+    for path in sources:
+        ext = posixpath.splitext(path)[1].lower()
+        with open(os.path.join(static_folder, path), "rb") as file:
+            data = file.read()
+
+        copies = {}
+        if ext == ".css":
+            def rewrite(match, base=posixpath.dirname(path)):
+                target = posixpath.normpath(posixpath.join(base, match.group(2)))
+                if target not in assets:
+                    return match.group(0)
+                return f"url('{posixpath.relpath(assets[target], base)}')"
+            data = CSS_URL.sub(rewrite, data.decode("utf-8")).encode("utf-8")
+        if ext in IMAGES and Image is not None:
+            data, webp = optimize_image(data, ext, max_width, quality)
+            if len(webp) < len(data):
+                copies[".webp"] = webp
+        if ext in COMPRESSIBLE:
+            copies.update(compress(data))
+
+        name = fingerprint(path, data)
+        assets[path] = name
+        variants[name] = sorted(copies)
+        os.makedirs(os.path.join(output, posixpath.dirname(name)), exist_ok=True)
+        for suffix, content in [("", data), *copies.items()]:
+            with open(os.path.join(output, name + suffix), "wb") as file:
+                file.write(content)
+
+    manifest = {"assets": assets, "variants": variants}
+    with open(os.path.join(output, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+class StaticAssets:
+    """
+    The object serves the assets written by build(). url_for("static", filename=...) resolves to the fingerprinted
+    copy whenever the manifest lists one, and those copies are served with an immutable year-long Cache-Control,
+    as a precompressed or WebP copy when the browser accepts one. Without a manifest, static files are served as
+    usual
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.assets = {}
+        self.variants = {}
+        self.directory = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = os.path.join(app.static_folder, "dist")
+        self.max_age = app.config.get("ASSET_MAX_AGE", 365 * 24 * 60 * 60)
+        self.load()
+        app.url_defaults(self._fingerprint)
+        app.add_url_rule(f"{app.static_url_path}/dist/<path:filename>", endpoint="assets", view_func=self.send)
+
+    def load(self):
+        try:
+            with open(os.path.join(self.directory, "manifest.json")) as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            manifest = {}
+        self.assets = {path: f"dist/{name}" for path, name in manifest.get("assets", {}).items()}
+        self.variants = manifest.get("variants", {})
+
+    def _fingerprint(self, endpoint, values):
+        if endpoint == "static" and values.get("filename") in self.assets:
+            values["filename"] = self.assets[values["filename"]]
+
+    def send(self, filename):
+        """ Serves a fingerprinted asset, choosing the smallest copy the request's Accept headers allow """
+        variants = self.variants.get(filename, ())
+        mimetype = mimetypes.guess_type(filename)[0]
+        name, encoding, vary = filename, None, None
+        if ".webp" in variants:
+            vary = "Accept"
+            if request.accept_mimetypes["image/webp"]:
+                name, mimetype = filename + ".webp", "image/webp"
+        elif variants:
+            vary = "Accept-Encoding"
+            for candidate, suffix in ENCODINGS:
+                if suffix in variants and request.accept_encodings[candidate]:
+                    name, encoding = filename + suffix, candidate
+                    break
+
+        response = send_from_directory(self.directory, name, mimetype=mimetype, max_age=self.max_age)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        if encoding is not None:
+            response.content_encoding = encoding
+        if vary is not None:
+            response.vary.add(vary)
+        return response
@@ -0,0 +1,31 @@
+import pytest
+import main
+
+
+@pytest.fixture
+def app(tmp_path):
+    (tmp_path / "uploads").mkdir()
+    app = main.create_app({
+        "TESTING": True,
+        "SECRET_KEY": "test",
+        "WTF_CSRF_ENABLED": False,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'meals.db'}",
+        "RECIPE_CACHE_URL": f"sqlite:///{tmp_path / 'recipe_cache.db'}",
+        "UPLOAD_FOLDER": str(tmp_path / "uploads"),
+        "TRIE_SNAPSHOT": str(tmp_path / "ingredient_trie.bin"),
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+        "PASSWORD_HASH_WORKERS": 0,
+    })
+    with app.app_context():
+        main.init_db()
+    yield app
+    with app.app_context():
+        main.db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """ A client signed in as the administrator, the first user registered """
+    client = app.test_client()
+    client.post("/register", data={"name": "Test", "email": "test@example.com", "password": "password"})
+    return client
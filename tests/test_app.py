@@ -0,0 +1,32 @@
+import main
+
+
+def make_app(tmp_path, name, **config):
+    return main.create_app({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / name}.db",
+        "RECIPE_CACHE_URL": f"sqlite:///{tmp_path / name}_cache.db",
+        "UPLOAD_FOLDER": str(tmp_path / name),
+        "TRIE_SNAPSHOT": str(tmp_path / f"{name}.bin"),
+        **config,
+    })
+
+
+def test_apps_keep_their_own_extensions(tmp_path):
+    first = make_app(tmp_path, "first")
+    second = make_app(tmp_path, "second", PAGE_CACHE_BACKEND="filesystem",
+                      PAGE_CACHE_DIR=str(tmp_path / "pages"), PANTRY_INDEX_SIZE=8)
+
+    with first.app_context():
+        assert main.csv_handler.app is first
+        assert main.trie.app.config["TRIE_SNAPSHOT"].endswith("first.bin")
+        assert type(main.page_cache.backend).__name__ == "MemoryBackend"
+        assert main.pantry_matcher.size == 256
+    with second.app_context():
+        assert main.csv_handler.app is second
+        assert main.trie.app.config["TRIE_SNAPSHOT"].endswith("second.bin")
+        assert type(main.page_cache.backend).__name__ == "FileSystemBackend"
+        assert main.pantry_matcher.size == 8
+
+
+def test_importing_main_creates_no_app():
+    assert not hasattr(main, "app")
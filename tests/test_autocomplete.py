@@ -0,0 +1,34 @@
+from autocomplete import Autocomplete
+from ingredient_trie import CompactTrie
+
+
+def make_autocomplete():
+    trie = CompactTrie()
+    trie.rebuild(["Garlic", "Ginger", "Grapes"])
+    autocomplete = Autocomplete(trie=trie)
+    autocomplete.load_library(1, {"Grapes": 5})
+    return autocomplete
+
+
+def test_user_boosts_follow_data_version():
+    autocomplete = make_autocomplete()
+    autocomplete.load_user(1, 3, {"Ginger": 10})
+    assert autocomplete.suggest("g", 1) == ["Ginger", "Grapes", "Garlic"]
+    assert autocomplete.loaded(1, 3)
+    assert not autocomplete.loaded(1, 4)
+
+
+def test_user_boosts_are_bounded():
+    autocomplete = make_autocomplete()
+    autocomplete.size = 2
+    for user_id in range(5):
+        autocomplete.load_user(user_id, 0, {})
+    assert list(autocomplete.users) == [3, 4]
+
+
+def test_usage_counts_expire():
+    autocomplete = make_autocomplete()
+    assert autocomplete.library_loaded(1)
+    assert not autocomplete.library_loaded(2)
+    autocomplete.ttl = 0
+    assert not autocomplete.library_loaded(1)
@@ -0,0 +1,37 @@
+import os
+import pytest
+from flask import Flask
+from credentials import Credentials, CredentialsBusy
+
+
+@pytest.fixture
+def credentials():
+    app = Flask(__name__)
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+    app.config["PASSWORD_HASH_WORKERS"] = 1
+    credentials = Credentials(app)
+    yield credentials
+    credentials.shutdown()
+
+
+def test_hash_in_pool(credentials):
+    stored = credentials.hash("password")
+    assert credentials.verify(stored, "password")
+    assert not credentials.needs_rehash(stored)
+
+
+def test_crashed_pool_is_replaced(credentials):
+    credentials.hash("password")
+    pool = credentials.pool
+    for process in list(pool._processes.values()):
+        process.kill()
+        process.join()
+
+    assert credentials.verify(credentials.hash("password"), "password")
+    assert credentials.pool is not pool
+
+
+def test_pool_that_keeps_crashing_is_busy(credentials):
+    with pytest.raises(CredentialsBusy):
+        credentials._run(os._exit, 1)
+    assert credentials.verify(credentials.hash("password"), "password")
@@ -0,0 +1,44 @@
+import pytest
+from ingredient_trie import CompactTrie
+
+LIBRARY = ["Salt", "Butter", "Water", "Chicken Broth", "Parmesan Cheese", "Garlic Cloves", "Olive Oil"]
+
+
+@pytest.fixture
+def trie():
+    trie = CompactTrie()
+    trie.rebuild(LIBRARY)
+    return trie
+
+
+@pytest.mark.parametrize("html", [
+    "<p>Salt</p><p>Parmesan Chese</p>",
+    "<ul><li>Salt</li><li>Parmesan Chese</li></ul>",
+    "Salt<br>Parmesan Chese",
+    "1 cup salt and Parmesan Chese",
+])
+def test_typo_beside_exact_match(trie, html):
+    assert trie.extract(html) == ["Salt", "Parmesan Cheese"]
+
+
+def test_typo_before_exact_match(trie):
+    assert trie.extract("2 tbsp olive oyl and a pinch of salt") == ["Olive Oil", "Salt"]
+
+
+def test_plurals_and_typos_in_one_fragment(trie):
+    assert trie.extract("2 garlic clove, parmesn cheeses") == ["Garlic Cloves", "Parmesan Cheese"]
+
+
+@pytest.mark.parametrize("html", [
+    "pancake batter",
+    "a large wafer",
+    "chicken brothers",
+    "<p>1 cup pancake batter</p>",
+])
+def test_near_words_in_recipe_text_are_not_linked(trie, html):
+    assert trie.extract(html) == []
+
+
+def test_exact_lookup_by_default(trie):
+    assert trie.lookup("butters") == "Butter"
+    assert trie.lookup("batter") is None
@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import requests
+from flask import Flask
+from recipe_api import RecipeLibrary
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Answers with the next of the server's queued (delay, status) replies, repeating the last one """
+
+    def do_GET(self):
+        server = self.server
+        server.calls += 1
+        delay, status = server.replies[min(server.calls, len(server.replies)) - 1]
+        time.sleep(delay)
+        body = json.dumps({"results": [], "status": status}).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.calls = 0
+    server.replies = [(0, 200)]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def make_library(stub, tmp_path, **config):
+    app = Flask(__name__)
+    app.config.update({
+        "SPOONACULAR_URL": f"http://127.0.0.1:{stub.server_port}",
+        "SPOON_API": "test",
+        "RECIPE_CACHE_URL": f"sqlite:///{tmp_path / 'recipe_cache.db'}",
+        "RECIPE_API_BACKOFF": 0.05,
+        **config,
+    })
+    return RecipeLibrary(app)
+
+
+def test_overloaded_responses_are_retried(stub, tmp_path):
+    stub.replies = [(0, 503), (0, 200)]
+    library = make_library(stub, tmp_path)
+    assert library.search_recipe_id("pasta")["status"] == 200
+    assert stub.calls == 2
+
+
+def test_retries_stop_at_the_budget(stub, tmp_path):
+    stub.replies = [(1, 200)]
+    library = make_library(stub, tmp_path, RECIPE_API_TIMEOUT=(1, 5), RECIPE_API_RETRIES=10, RECIPE_API_BUDGET=0.5)
+    start = time.monotonic()
+    with pytest.raises(requests.Timeout):
+        library.search_recipe_id("pasta")
+    assert time.monotonic() - start < 0.9
+    assert stub.calls == 1
+
+
+def test_expired_response_is_served_when_the_budget_runs_out(stub, tmp_path):
+    library = make_library(stub, tmp_path, RECIPE_CACHE_TTLS={"search": (0, 0)}, RECIPE_API_BUDGET=0.3)
+    expected = library.search_recipe_id("pasta")
+    stub.replies = [(0, 200), (1, 200)]
+    start = time.monotonic()
+    assert library.search_recipe_id("pasta") == expected
+    assert time.monotonic() - start < 0.8
+    assert library.cache_stats()["stale_errors"] == 1
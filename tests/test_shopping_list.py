@@ -0,0 +1,24 @@
+import main
+
+
+def test_ingredients_sharing_a_name_are_listed_separately(app, client):
+    with app.app_context():
+        db = main.db
+        category = main.Category(name="Dinner", user_id=1)
+        first = main.Ingredients(key="chili pepper", name="Chili")
+        second = main.Ingredients(key="chili powder", name="Chili")
+        db.session.add_all([category, first, second])
+        db.session.flush()
+        monday = db.session.scalar(db.select(main.WeeklyMeal.id).where(main.WeeklyMeal.user_id == 1,
+                                                                        main.WeeklyMeal.day_of_week == "Monday"))
+        for name, ingredients in [("Stew", [first, second]), ("Tacos", [first])]:
+            db.session.add(main.Recipes(name=name, recipe_type="Dinner", img="", link="", ingredients="",
+                                        directions="", user_id=1, category_id=category.id, my_week_id=monday,
+                                        ingredient=ingredients))
+        db.session.commit()
+
+    items = client.get("/shopping_list/1?format=json").json["items"]
+    assert items == [{"name": "Chili", "recipes": 2}, {"name": "Chili", "recipes": 1}]
+
+    with app.app_context():
+        assert main.ingredient_counts(1)["Chili"] == 3
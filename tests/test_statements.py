@@ -0,0 +1,58 @@
+import pytest
+import main
+
+# The user, the week's days, their recipes and whether the user has any recipes at all
+MY_WEEK_STATEMENTS = 4
+# The user, the recipe with its day and the recipe's ingredients
+VIEW_RECIPE_STATEMENTS = 3
+
+
+@pytest.fixture
+def kitchen(app, client):
+    """ A category and the dictionary ingredients to fill recipes with, for the signed in user """
+    app.config["LIBRARY_CHECK_INTERVAL"] = float("inf")
+    with app.app_context():
+        category = main.Category(name="Dinner", user_id=1)
+        ingredients = [main.Ingredients(key=f"ingredient {i}", name=f"Ingredient {i}") for i in range(8)]
+        main.db.session.add_all([category, *ingredients])
+        main.db.session.commit()
+        return category.id
+
+
+def add_recipes(app, category_id, count, ingredients=3):
+    """ Adds recipes spread over the week the way the routes would, bumping the user's data version """
+    with app.app_context():
+        db = main.db
+        days = db.session.scalars(db.select(main.WeeklyMeal.id).where(main.WeeklyMeal.user_id == 1)).all()
+        linked = db.session.scalars(db.select(main.Ingredients).order_by(main.Ingredients.id).limit(ingredients)).all()
+        recipes = [main.Recipes(name=f"Recipe {i}", recipe_type="Dinner", img="", link="", ingredients="",
+                                directions="", user_id=1, category_id=category_id, my_week_id=days[i % len(days)],
+                                ingredient=list(linked)) for i in range(count)]
+        db.session.add_all(recipes)
+        main.touch_user_data(1)
+        db.session.commit()
+        return [recipe.id for recipe in recipes]
+
+
+def statements(app, client, url, endpoint):
+    """ The statements one request ran, read from the per-endpoint count the metrics engine hook records """
+    histograms = app.extensions["meal_planner"]["metrics"].histograms
+    key = ("http_request_sql_statements", (("endpoint", endpoint),))
+    before = histograms[key].sum if key in histograms else 0
+    assert client.get(url).status_code == 200
+    return histograms[key].sum - before
+
+
+def test_my_week_statements_do_not_grow_with_recipes(app, client, kitchen):
+    add_recipes(app, kitchen, 1)
+    assert statements(app, client, "/my_week/1", "main.my_week") == MY_WEEK_STATEMENTS
+    add_recipes(app, kitchen, 20)
+    assert statements(app, client, "/my_week/1", "main.my_week") == MY_WEEK_STATEMENTS
+
+
+def test_view_recipe_statements_do_not_grow_with_recipes_or_ingredients(app, client, kitchen):
+    first, = add_recipes(app, kitchen, 1, ingredients=1)
+    assert statements(app, client, f"/view_recipe/1/{first}", "main.view_recipe") == VIEW_RECIPE_STATEMENTS
+    last = add_recipes(app, kitchen, 20, ingredients=8)[-1]
+    assert statements(app, client, f"/view_recipe/1/{first}", "main.view_recipe") == VIEW_RECIPE_STATEMENTS
+    assert statements(app, client, f"/view_recipe/1/{last}", "main.view_recipe") == VIEW_RECIPE_STATEMENTS
@@ -0,0 +1,63 @@
+import os
+from flask import g
+from sqlalchemy.orm import make_transient_to_detached
+from page_cache import MemoryBackend, FileSystemBackend
+
+
+class UserCache:
+    """
+    The object loads users once per request, keeping them in flask.g so the login manager and every route share the
+    same instance. With USER_CACHE_TTL set, the users' column values are also kept between requests, minus the
+    password hash, and merged back into the session without a query. Entries are dropped when a user's row changes,
+    which reaches other workers only through the filesystem backend, so with the memory backend and several workers
+    a change can take up to the TTL to be seen everywhere
+    """
+
+    def __init__(self, app=None, db=None, model_of=None):
+        self.app = None
+        self.db = db
+        # Called for the model class on first use, since the extensions are created before the models
+        self.model_of = model_of
+        self.ttl = 0
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get("USER_CACHE_TTL", 0)
+        if app.config.get("USER_CACHE_BACKEND", "memory") == "filesystem":
+            self.backend = FileSystemBackend(app.config.get("USER_CACHE_DIR",
+                                                            os.path.join(app.instance_path, "user_cache")))
+        else:
+            self.backend = MemoryBackend(app.config.get("USER_CACHE_SIZE", 1024))
+
+    def get(self, user_id):
+        """ Returns the user with the given ID attached to the current session, or None """
+        users = g.setdefault("users", {})
+        user = users.get(user_id)
+        if user is None:
+            user = users[user_id] = self._load(user_id)
+        return user
+
+    def _load(self, user_id):
+        model = self.model_of()
+        if not self.ttl:
+            return self.db.session.get(model, user_id)
+
+        values = self.backend.get(str(user_id))
+        if values is not None:
+            user = model(**values)
+            make_transient_to_detached(user)
+            return self.db.session.merge(user, load=False)
+
+        user = self.db.session.get(model, user_id)
+        if user is not None:
+            self.backend.set(str(user_id), {column.key: getattr(user, column.key)
+                                            for column in model.__mapper__.column_attrs
+                                            if column.key != "password"}, self.ttl)
+        return user
+
+    def invalidate(self, user_id):
+        if self.backend is not None:
+            self.backend.delete(str(user_id))